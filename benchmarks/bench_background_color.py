@@ -0,0 +1,78 @@
+"""
+Compare the fast background color engine (k-means on a sample of the
+pixels) with the full one (k-means on every pixel): time per cover
+and how far the fast color is from the full one
+
+The full engine isn't deterministic itself (k-means starts from random
+centers), so it is also compared with a second run of itself
+
+Run from the repository root:
+    python benchmarks/bench_background_color.py [--images a.jpg b.png] [--synthetic 10] [--size 1000]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import argparse
+import glob
+import time
+import numpy as np
+from PIL import Image
+from spotify_background_color import SpotifyBackgroundColor
+
+examples = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+parser = argparse.ArgumentParser(description='Benchmark the background color engines.')
+parser.add_argument('--images', nargs='+', help='Cover images to use.', default=sorted(glob.glob(os.path.join(examples, '*.png')) + glob.glob(os.path.join(examples, '*.jpg'))))
+parser.add_argument('--synthetic', type=int, help='Amount of generated covers to use as well.', default=10)
+parser.add_argument('--size', type=int, help='Width and height of the generated covers.', default=1000)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+def synthetic(rng: np.random.Generator) -> Image.Image:
+    """
+    A cover of a few colored blocks over a gradient, with some noise
+    """
+
+    size = args.size
+    base = np.linspace(rng.integers(0, 256, 3), rng.integers(0, 256, 3), size)[:, None, :].repeat(size, axis=1)
+    for _ in range(rng.integers(1, 5)):
+        x, y = rng.integers(0, size, 2)
+        w, h = rng.integers(size // 10, size // 2, 2)
+        base[y:y + h, x:x + w] = rng.integers(0, 256, 3)
+
+    noisy = base + rng.normal(0, 8, base.shape)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+def full(im: Image.Image) -> tuple:
+    return SpotifyBackgroundColor(np.array(im)).best_color()
+
+def fast(im: Image.Image) -> tuple:
+    return SpotifyBackgroundColor(np.array(im)).best_color(fast=True)
+
+def timed(func, im: Image.Image) -> tuple:
+    start = time.perf_counter()
+    result = func(im)
+    return result, (time.perf_counter() - start) * 1000
+
+rng = np.random.default_rng(args.seed)
+covers = [(os.path.basename(path), Image.open(path).convert('RGB')) for path in args.images]
+covers += [(f'synthetic_{i}', synthetic(rng)) for i in range(args.synthetic)]
+
+print(f'{"cover":<24}{"full (ms)":>11}{"fast (ms)":>11}{"full":>17}{"fast":>17}{"distance":>10}{"full vs full":>14}')
+times, distances, baseline = [], [], []
+for name, im in covers:
+    full_color, full_time = timed(full, im)
+    fast_color, fast_time = timed(fast, im)
+    distance = float(np.linalg.norm(np.subtract(full_color, fast_color)))
+    rerun = float(np.linalg.norm(np.subtract(full_color, full(im))))
+
+    times.append((full_time, fast_time))
+    distances.append(distance)
+    baseline.append(rerun)
+    print(f'{name:<24}{full_time:>11.1f}{fast_time:>11.1f}{str(full_color):>17}{str(fast_color):>17}{distance:>10.1f}{rerun:>14.1f}')
+
+full_time, fast_time = np.mean(times, axis=0)
+print(f'\nAverage: full {full_time:.1f} ms, fast {fast_time:.1f} ms ({full_time / fast_time:.1f}x faster)')
+print(f'RGB distance fast vs full: mean {np.mean(distances):.1f}, max {np.max(distances):.1f}, {np.mean(np.array(distances) < 30):.0%} under 30')
+print(f'RGB distance full vs full: mean {np.mean(baseline):.1f}, max {np.max(baseline):.1f}')
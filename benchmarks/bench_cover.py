@@ -0,0 +1,90 @@
+"""
+Compare the per-pixel cover art renderer coverArtToText used to
+have with the lookup table one (resources.asciiArt) over a few
+cover sizes: render time, output size and whether both show
+exactly the same characters in the same colors
+
+Run from the repository root:
+    python benchmarks/bench_cover.py [--images examples/example_0.png] [--sizes 10 20 40 60] [--runs 5]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import argparse
+import glob
+import re
+import time
+from PIL import Image
+import resources
+
+parser = argparse.ArgumentParser(description='Benchmark the ascii cover art renderer.')
+parser.add_argument('--images', nargs='+', help='Images to render.', default=sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.png'))))
+parser.add_argument('--sizes', type=int, nargs='+', help='Cover sizes (--size) to render at.', default=[10, 20, 40, 60])
+parser.add_argument('--runs', type=int, help='Amount of runs to average over.', default=5)
+args = parser.parse_args()
+
+def perPixel(im: Image.Image, density: dict, s: int) -> str:
+    """
+    The renderer as it was: getpixel and min() for every pixel
+    """
+
+    im = im.resize((s * 2, s), Image.Resampling.LANCZOS)
+    mono = im.convert('L')
+    im = im.convert('RGB')
+
+    img = []
+    tmp = ''
+    for y in range(im.height):
+        for x in range(im.width):
+            mono_pixel = mono.getpixel((x, y))
+            r, g, b = im.getpixel((x, y))
+
+            density_char, _ = min(density.items(), key=lambda i: abs(mono_pixel - i[1]))
+            tmp += f"\x1b[1m\x1b[38;2;{r};{g};{b}m{density_char}\x1b[0m"
+
+        img.append(tmp)
+        tmp = ''
+
+    return '\n'.join(img)
+
+def cells(text: str) -> list:
+    """
+    What a terminal shows for the text: (character, bold, color) of every cell
+    """
+
+    shown = []
+    bold, color = False, None
+    for code, char in re.findall(r'\x1b\[([0-9;]*)m|(.|\n)', text):
+        if char:
+            shown.append((char, bold, color))
+        elif code == '1':
+            bold = True
+        elif code == '0':
+            bold, color = False, None
+        else:
+            color = code
+
+    return shown
+
+def timed(func, *func_args) -> tuple:
+    """
+    Return the result of the last run and the average time of a run in ms
+    """
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        result = func(*func_args)
+
+    return result, (time.perf_counter() - start) / args.runs * 1000
+
+print(f'{"image":<16}{"size":>6}{"per pixel (ms)":>16}{"lut (ms)":>12}{"speedup":>10}{"per pixel":>12}{"lut":>10}{"smaller":>9}{"identical":>11}')
+for path in args.images:
+    im = Image.open(path)
+    im.load()
+    for size in args.sizes:
+        old, old_time = timed(perPixel, im, resources.DENSITY, size)
+        new, new_time = timed(resources.asciiArt, im, resources.DENSITY, size)
+        old_size, new_size = len(old.encode('utf-8')), len(new.encode('utf-8'))
+        print(f'{os.path.basename(path):<16}{size:>6}{old_time:>16.2f}{new_time:>12.2f}{old_time / new_time:>9.1f}x{resources.formatBytes(old_size):>12}{resources.formatBytes(new_size):>10}{old_size / new_size:>8.1f}x{str(cells(old) == cells(new)):>11}')
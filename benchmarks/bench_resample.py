@@ -0,0 +1,74 @@
+"""
+Compare the old 44.1 kHz .wav payload with the 16 kHz one
+sampleAudio builds now: payload size, resample time and
+signature (fingerprint) time, optionally the recognition latency
+
+Run from the repository root:
+    python benchmarks/bench_resample.py [--seconds 5] [--runs 5] [--network]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import argparse
+import asyncio
+import time
+import numpy as np
+import resources
+import song
+
+parser = argparse.ArgumentParser(description='Benchmark the 16 kHz capture path against the 44.1 kHz one.')
+parser.add_argument('--seconds', type=float, help='Length of the sample in seconds.', default=5)
+parser.add_argument('--runs', type=int, help='Amount of runs to average over.', default=5)
+parser.add_argument('--network', action='store_true', help='Also send the signatures to the Shazam API and time the requests.')
+args = parser.parse_args()
+
+def synthetic(seconds: float, rate: int) -> np.ndarray:
+    """
+    A few seconds of chords with some noise, as int16 recorded at rate
+    """
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    chords = sum(np.sin(2 * np.pi * f * t) * (1 + np.sin(t * i)) for i, f in enumerate([220, 277.18, 329.63, 440, 554.37]))
+    audio = chords * 0.08 + rng.normal(0, 0.01, len(t))
+    return (audio * 32767).astype(np.int16).reshape(-1, 1)
+
+def timed(func, *func_args) -> tuple:
+    """
+    Return the result of the last run and the average time of a run in ms
+    """
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        result = func(*func_args)
+
+    return result, (time.perf_counter() - start) / args.runs * 1000
+
+raw = synthetic(args.seconds, 44100)
+
+def oldPath() -> bytearray:
+    audio_data, samples = resources.wavBuffer(len(raw), 44100)
+    samples[:] = raw
+    return audio_data
+
+def newPath() -> bytearray:
+    audio_data, samples = resources.wavBuffer(int(16000 * args.seconds), 16000)
+    resources.resample(raw, 44100, 16000, samples)
+    return audio_data
+
+async def recognize(signature) -> float:
+    from shazamio import Shazam
+
+    shazam = Shazam()
+    start = time.perf_counter()
+    await shazam.send_recognize_request_v2(signature)
+    return (time.perf_counter() - start) * 1000
+
+print(f'{"path":<10}{"payload":>14}{"build (ms)":>14}{"signature (ms)":>18}{"request (ms)":>16}')
+for name, path in [('44.1 kHz', oldPath), ('16 kHz', newPath)]:
+    payload, build = timed(path)
+    signature, fingerprint = timed(song.generateSignature, payload, args.seconds)
+    request = f'{asyncio.run(recognize(signature)):.1f}' if args.network else '-'
+    print(f'{name:<10}{resources.formatBytes(len(payload)):>14}{build:>14.2f}{fingerprint:>18.2f}{request:>16}')
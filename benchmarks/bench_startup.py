@@ -0,0 +1,74 @@
+"""
+Time the cold start of the commands that don't record anything, with
+python -X importtime: wall time of the whole command, the time spent
+importing modules and the heaviest packages imported (besides sngfetch's
+own modules), so libraries imported where they aren't needed show up
+
+Every run uses an empty temporary home directory, so the history and
+caches of the user aren't touched
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+
+import os
+import sys
+
+import argparse
+import subprocess
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+SNGFETCH = os.path.join(SRC, 'sngfetch.py')
+LOCAL = {name[:-3] for name in os.listdir(SRC) if name.endswith('.py')} # sngfetch's own modules
+
+parser = argparse.ArgumentParser(description='Benchmark the startup time of sngfetch commands.')
+parser.add_argument('--runs', type=int, help='Amount of runs to average over.', default=5)
+parser.add_argument('--top', type=int, help='Amount of heaviest packages to show for each command.', default=3)
+args = parser.parse_args()
+
+COMMANDS = [
+    ['-v'],
+    ['--help'],
+    ['--history'],
+    ['--freeze', 'frozen.json'],
+    ['--remove', 'nothing'],
+    ['--history-clear'],
+]
+
+def run(command: list, home: str) -> tuple:
+    """
+    Run a command, returns (wall time in ms, total import time in ms,
+    import time of each package in ms)
+    """
+
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', SNGFETCH, *command], input='n\n', capture_output=True, text=True, env=env, cwd=home)
+    wall = (time.perf_counter() - start) * 1000
+
+    total = 0
+    packages = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative, name = line.split('|')
+        if not name.startswith('  '): # Top level imports, their time includes everything they import
+            total += int(cumulative) / 1000
+
+        name = name.strip()
+        if '.' not in name and name not in LOCAL:
+            packages[name] = max(packages.get(name, 0), int(cumulative) / 1000)
+
+    return wall, total, packages
+
+print(f'{"command":<28}{"wall (ms)":>12}{"imports (ms)":>14}  heaviest packages')
+with tempfile.TemporaryDirectory() as home:
+    for command in COMMANDS:
+        results = [run(command, home) for _ in range(args.runs)]
+        wall = sum(result[0] for result in results) / args.runs
+        imports = sum(result[1] for result in results) / args.runs
+        heaviest = sorted(results[-1][2].items(), key=lambda i: i[1], reverse=True)[:args.top]
+        print(f'{" ".join(command):<28}{wall:>12.1f}{imports:>14.1f}  {", ".join(f"{name} ({ms:.0f} ms)" for name, ms in heaviest)}')
@@ -0,0 +1,95 @@
+"""
+Replay recorded (or generated) listening sessions against the
+schedulers in scheduler.py and compare how many attempts and how
+much time each one needs for a match
+
+A trace is a json list with one entry per second of audio:
+    [{"level": -28.5, "music": true}, ...]
+and the recognizer is modelled as matching a sample once it holds
+--need seconds of music (twice that when the music is quieter than
+--quiet dBFS), answering after --latency seconds (with some jitter)
+
+Run from the repository root:
+    python benchmarks/replay_scheduler.py [--traces a.json b.json] [--sessions 200]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import argparse
+import json
+import random
+from types import SimpleNamespace
+import scheduler
+
+parser = argparse.ArgumentParser(description='Compare the sample schedulers on replayed listening sessions.')
+parser.add_argument('--traces', nargs='+', help='Trace files to replay, random sessions are generated if not given.')
+parser.add_argument('--sessions', type=int, help='The amount of sessions to generate.', default=200)
+parser.add_argument('--total', type=int, help='The --total passed to the schedulers.', default=30)
+parser.add_argument('--duration', type=int, help='The --duration passed to the schedulers.', default=3)
+parser.add_argument('--need', type=float, help='Seconds of music the modelled recognizer needs for a match.', default=4)
+parser.add_argument('--quiet', type=float, help='Level (dBFS) under which the recognizer needs twice as much music.', default=-35)
+parser.add_argument('--latency', type=float, help='Average latency of the modelled recognizer in seconds.', default=1)
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+def generate() -> list:
+    """
+    A session of silence followed by a song with a random level
+    """
+
+    silence = random.randint(0, 8)
+    level = random.uniform(-50, -15)
+    return [{'level': -70, 'music': False}] * silence + [{'level': level + random.uniform(-3, 3), 'music': True} for _ in range(120)]
+
+def replay(trace: list, name: str) -> tuple:
+    """
+    Replay a trace, returns (matched, attempts, seconds)
+    """
+
+    clock = SimpleNamespace(now=0.0)
+    scheduler.time = SimpleNamespace(monotonic=lambda: clock.now) # Run the schedulers on the replayed time
+    schedule = scheduler.SCHEDULERS[name](args.total, args.duration)
+
+    pending = [] # (answer time, matched) of the requests in flight
+    itr = 0
+    while (duration := schedule.next(itr)) is not None:
+        start, clock.now = clock.now, clock.now + duration
+        window = trace[int(start):int(clock.now)] or trace[-1:]
+
+        # Requests that were answered while this sample was recorded
+        for answered, matched in sorted(pending):
+            if answered <= clock.now:
+                if matched:
+                    return True, itr, answered
+                schedule.observe(matched=False)
+                pending.remove((answered, matched))
+
+        level = sum(second['level'] for second in window) / len(window)
+        music = sum(second['music'] for second in window)
+        need = args.need * (2 if level < args.quiet else 1)
+        latency = max(0.1, random.gauss(args.latency, args.latency / 4))
+
+        schedule.observe(level=level, latency=latency)
+        pending.append((clock.now + latency, music >= need))
+        itr += 1
+
+    for answered, matched in sorted(pending):
+        if matched:
+            return True, itr, answered
+
+    return False, itr, clock.now
+
+traces = [json.load(open(path)) for path in args.traces] if args.traces else [generate() for _ in range(args.sessions)]
+
+print(f'{"scheduler":<12}{"matched":>10}{"attempts":>12}{"seconds":>12}')
+for name in scheduler.SCHEDULERS:
+    random.seed(args.seed) # Same latencies for every scheduler
+    results = [replay(trace, name) for trace in traces]
+    matched = [result for result in results if result[0]]
+    attempts = sum(result[1] for result in matched) / max(len(matched), 1)
+    seconds = sum(result[2] for result in matched) / max(len(matched), 1)
+    print(f'{name:<12}{len(matched) / len(results):>10.0%}{attempts:>12.2f}{seconds:>12.2f}')
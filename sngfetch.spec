@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['sklearn.tree._partitioner'],
+    hiddenimports=['sklearn.tree._partitioner', 'scipy.misc'], # scipy.misc was imported by spotify_background_color.py for the frozen build
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
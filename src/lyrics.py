@@ -1,10 +1,9 @@
 import os
-import requests
+import net
 from resources import userError, debug, db_print, finish, stripNonAlphaNum, matching
 from sys import platform
 import subprocess
 import urllib.parse
-import bs4
 import re
 
 class Lyrics:
@@ -54,15 +53,16 @@ class Lyrics:
         
         return result
 
-    def getFromUrl(song_url: str):
+    async def getFromUrl(song_url: str):
         """
         Get song lyrics from a genius search url
         """
 
+        import bs4
+
         debug(f'Fetching lyrics from url: {song_url}.')
-        response = requests.get(song_url)
+        html = await net.CLIENT.get(song_url, 'text')
         debug(f'Got response from url: {song_url}.')
-        html = response.text
         soup = bs4.BeautifulSoup(html, 'html.parser')
 
         # All the divs that start with Lyrics-sc
@@ -183,13 +183,15 @@ class Lyrics:
         debug(f'Lyrics: {Lyrics.truncate(lyrics[1:-1])}.', level=2)
         return '\n'.join(Lyrics.truncate(lyrics[1:-1])).strip()
     
-    def getFromTitle(search_string: str, title:str, file_path: str):
+    async def getFromTitle(search_string: str, title:str, file_path: str, quiet: bool = False):
         """
         Get lyrics from title (this method is the one used to find lyrics in the main program) by
-        getting the url and running it trough getFromUrl
+        getting the url and running it trough getFromUrl, quiet is set when the lyrics are fetched
+        before anything is displayed, so nothing is printed
         """
 
-        db_print('Fetching lyrics...\x1b[1A')
+        if not quiet:
+            db_print('Fetching lyrics...\x1b[1A')
         debug(f'Fetching lyrics for {title=} with {search_string=}.')
         
         debug(f'Checking for Genius API credentials in file: {file_path}.')
@@ -206,14 +208,18 @@ class Lyrics:
         debug(f'{search_headers=}', level=2)
 
         debug(f'Sending GET request to {search_url} with headers.')
-        response = requests.get(search_url, headers=search_headers)
-        debug('Got response.')
+        try:
+            response = await net.CLIENT.get(search_url, headers=search_headers)
+            debug('Got response.')
+        except Exception as e:
+            debug(f'Genius API error: {e}', 'error', '\x1b[31m')
+            response = None
+
         debug(f'{response=}', level=2)
         song_url = None
 
-        debug(f'Status code: {response.status_code}', level=2)
-        if response.status_code == 200:
-            search_results = response.json().get('response', {}).get('hits', []) # hits is an iterable containing among other things result
+        if response is not None:
+            search_results = response.get('response', {}).get('hits', []) # hits is an iterable containing among other things result
             
             debug(f'Got search results.')
             debug(f'{search_results=}', level=2)
@@ -233,7 +239,8 @@ class Lyrics:
                 # up the result (yes this was an actual problem I had on a song)
                 if song_url and matching(song_title, title):
                     debug(f'Found song url, getting lyrics from url.')
-                    return Lyrics.getFromUrl(song_url), song_url
+                    return await Lyrics.getFromUrl(song_url), song_url
         
         # The program would have already exited if the lyrics had been found
-        db_print(f"Unable to fetch lyrics for '{title}'.")
\ No newline at end of file
+        if not quiet:
+            db_print(f"Unable to fetch lyrics for '{title}'.")
\ No newline at end of file
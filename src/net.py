@@ -0,0 +1,104 @@
+from resources import debug
+from typing import Any
+import asyncio
+
+"""
+The http client every request goes trough (Shazam, Deezer, cover
+art and Genius), so they all share one pool of kept alive connections
+instead of opening a new one (and doing a new TLS handshake) each time.
+aiohttp is only imported once the first request is made.
+"""
+
+class Client:
+    """
+    Lazily opens one aiohttp session for the running event loop with
+    limits on the connections in total and per host, identical requests
+    made while one is in flight share its response (singleflight)
+    """
+
+    def __init__(self, limit: int = 32, limit_per_host: int = 6, timeout: float = 30, connect_timeout: float = 10):
+        self.limit = limit # The maximum amount of open connections
+        self.limit_per_host = limit_per_host # The maximum amount of open connections to one host
+        self.timeout = timeout # Seconds, used when a request doesn't pass its own timeout
+        self.connect_timeout = connect_timeout
+        self.client = None
+        self.inflight = {} # Requests in flight by (url, kind, headers)
+        self.waiters = {} # The amount of callers waiting on each request in flight
+
+    def session(self) -> 'aiohttp.ClientSession':
+        """
+        The shared session, created on first use since
+        it has to belong to the running event loop
+        """
+
+        import aiohttp
+
+        if self.client is None or self.client.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=300, keepalive_timeout=30)
+            self.client = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout))
+            debug(f'Opened http session ({self.limit} connections, {self.limit_per_host} per host).')
+
+        return self.client
+
+    async def _get(self, url: str, kind: str, headers: dict | None, timeout: float | None) -> Any:
+        import aiohttp
+
+        debug(f'GET {url}', level=1)
+        # Without a timeout of its own the request keeps the session's (passing None would turn it off)
+        options = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with self.session().get(url, headers=headers, **options) as resp:
+            resp.raise_for_status()
+
+            if kind == 'json':
+                return await resp.json(content_type=None) # Not every API sends the json content type
+            elif kind == 'text':
+                return await resp.text()
+
+            return await resp.read()
+
+    async def get(self, url: str, kind: str = 'json', headers: dict | None = None, timeout: float | None = None) -> Any:
+        """
+        GET url and return its body as json, text or bytes (kind),
+        raises aiohttp.ClientResponseError on an error status
+        """
+
+        key = (url, kind, tuple(sorted((headers or {}).items())))
+        task = self.inflight.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(self._get(url, kind, headers, timeout))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            debug(f'Joined in-flight request for {url}.', level=1)
+
+        # Shielded so one caller giving up doesn't cancel the request for the others,
+        # when the last one gives up the request is cancelled as nobody needs it anymore
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self.waiters[task] == 1:
+                debug(f'Cancelled request for {url}.', level=1)
+                task.cancel()
+            raise
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+
+    def _done(self, key: tuple, task: asyncio.Future) -> None:
+        self.inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception() # Retrieved here, if every caller gave up nobody else will
+
+    async def close(self) -> None:
+        for task in list(self.inflight.values()):
+            task.cancel()
+
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+            debug('Closed http session.')
+
+CLIENT = Client()
@@ -1,17 +1,24 @@
-from spotify_background_color import SpotifyBackgroundColor
 import sys
-import numpy as np
 import struct
-import sounddevice as sd
-from PIL import Image
+from math import gcd
 from typing import Tuple, Any, Iterable
+from collections import OrderedDict
 from datetime import datetime as dt
 import inspect
+import threading
+import hashlib
+import json
+import time
+import os
 import re
 
 """
 This library is used for small functionality and
 for storing global variables.
+
+The heavy libraries (numpy, sounddevice, scipy, PIL and the background
+color's sklearn and matplotlib) are imported by the functions that
+use them, so commands that don't need them start quickly.
 """
 
 class userError:
@@ -27,6 +34,51 @@ DISABLE_STDOUT = False
 LOG = []
 LOG_PATH = ''
 MINIMALIST_LEVEL = -1
+AUDIO_BUFFERS = {} # The AudioBuffer each input device is recorded into by device (None is the default device), started on the first sampleAudio call
+COLORS = 'truecolor' # The colors the terminal can show: 'truecolor', '256' or '16'
+COLOR_ENGINE = 'fast' # How the background color of the cover art is found, 'fast' clusters a sample of the pixels and 'full' all of them
+CACHE_ONLY = False # Never call the Deezer API, only use cached responses
+DENSITY = { # The character used for each gray level in the cover art
+    'Ñ': 255,
+    '@': 245,
+    '#': 235,
+    'W': 225,
+    '$': 215,
+    '9': 205,
+    '8': 195,
+    '7': 185,
+    '6': 175,
+    '5': 165,
+    '4': 155,
+    '3': 145,
+    '2': 135,
+    '1': 125,
+    '0': 115,
+    '?': 105,
+    '!': 95,
+    'a': 85,
+    'b': 75,
+    'c': 65,
+    ';': 55,
+    ':': 50,
+    '+': 45,
+    '=': 40,
+    '-': 35,
+    '*': 20,
+    ',': 10,
+    '.': 5,
+}
+DENSITY_LUTS = {} # Density character of every gray level (0..255) by density map
+PALETTE_LUTS = {} # Nearest palette color of every 32x32x32 bin of RGB (the top 5 bits of each channel) by palette
+PALETTE_CODES = {} # The foreground and background color codes of every palette color by palette
+XTERM_16 = [ # The default colors of the 16 color palette of xterm
+    (0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0), (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+    (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0), (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255),
+]
+SAMPLE_OVERLAP = 1 # Seconds of each microphone sample that are also in the one before it, so audio at the border of two samples is in one of them whole
+HEDGE_DELAY = None # Seconds after which the Deezer search is started if the ISRC lookup hasn't answered (None waits for the ISRC lookup)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sngfetch_cache') # Every Cache gets a directory in here
+CACHES = {} # Caches already opened by getCache, by name
 
 def debug(value: object, status: str | None = 'info', color: str = '', level: int = 0) -> None:
     """
@@ -59,6 +111,45 @@ def db_print(*values: object, sep: str | None = " ", end: str | None = "\n", fil
         if LOG_PATH:
             LOG.append(sep.join(values))
 
+class Frame:
+    """
+    Collects what db_print would print and sends it all
+    with one write on flush, so a whole screen (like the
+    cover art with the metadata next to it) shows up at once
+    """
+
+    def __init__(self):
+        self.parts = [] # The strings to write, clear sequences included
+        self.log = [] # The lines to log, like db_print logs them
+
+    def print(self, *values: object, sep: str = ' ', end: str = '\n', no_clear: bool = False) -> None:
+        """
+        Add values to the frame, takes the same arguments as db_print
+        """
+
+        values = [str(value) for value in values]
+        if MINIMALIST_LEVEL == 2:
+            # Remove all ansi escape codes
+            values = [ansi_escape.sub('', value) for value in values]
+
+        self.parts.append(f'{"" if no_clear else "\r\x1b[0K"}{sep.join(values)}{end}')
+        self.log.append(sep.join(values))
+
+    def flush(self) -> None:
+        """
+        Write the frame to stdout and start a new one
+        """
+
+        if not DISABLE_STDOUT and self.parts:
+            sys.stdout.write(''.join(self.parts))
+            sys.stdout.flush()
+
+            if LOG_PATH:
+                LOG.extend(self.log)
+
+        debug(f'Flushed a frame of {len(self.parts)} lines.', level=1)
+        self.parts, self.log = [], []
+
 
 def getIndex(index: int, itr: Iterable, fallback: Any | None = None) -> Any:
     """
@@ -138,98 +229,610 @@ def formatBytes(size: int) -> Tuple[int, str]:
         return f'{size} {power_labels[0]}'
 
 
-def sampleAudio(t: int, gain: int = 2) -> bytes:
+class Cache:
     """
-    Get an audio sample of t seconds with the gain of gain in bytes
+    LRU cache with a time to live, kept in memory and on
+    disk as one json file per entry in CACHE_DIR/name
     """
 
-    CHANNELS = 1
-    RATE = 44100
-    WIDTH = 2
-    RECORD_SECONDS = t
+    def __init__(self, name: str, ttl: float | None = None, max_entries: int | None = None, max_bytes: int | None = None):
+        self.name = name
+        self.path = os.path.join(CACHE_DIR, name)
+        self.ttl = ttl # Seconds an entry is valid for, None never expires
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # File name -> size in bytes, least recently used first
+        self.memory = {} # File name -> entry, for the entries already read
+        self.size = 0 # Total size of the entries in bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # Caches are shared with worker threads
 
-    debug(f'Recording audio for {RECORD_SECONDS} seconds.')
-    audio_array = sd.rec(int(RATE * RECORD_SECONDS), samplerate=RATE, channels=CHANNELS, dtype='int16')
-    sd.wait()
-    debug('Recording stopped got audio array.')
-    
-    audio_data = np.clip(audio_array * gain, -32768, 32767).astype(np.int16).tobytes()
-    debug('Converted audio array to bytes.')
+        os.makedirs(self.path, exist_ok=True)
+        # The modification time of a file is when it was last used
+        for entry in sorted(os.scandir(self.path), key=lambda e: e.stat().st_mtime):
+            if entry.name.endswith('.json'):
+                self.entries[entry.name] = entry.stat().st_size
+                self.size += entry.stat().st_size
+
+        debug(f'Opened {name} cache with {len(self.entries)} entries ({formatBytes(self.size)}).', level=1)
+
+    def _file(self, key: str) -> str:
+        return f'{hashlib.sha1(key.encode("utf-8")).hexdigest()}.json'
+
+    def _drop(self, name: str) -> None:
+        self.size -= self.entries.pop(name, 0)
+        self.memory.pop(name, None)
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def get(self, key: str, default: Any = None) -> Any:
+        name = self._file(key)
+
+        with self.lock:
+            entry = None
+            if name in self.entries:
+                entry = self.memory.get(name)
+                if entry is None:
+                    try:
+                        with open(os.path.join(self.path, name), 'r') as f:
+                            entry = json.load(f)
+                    except (OSError, ValueError):
+                        self._drop(name)
+
+            if entry and entry['key'] == key and entry['expires'] and entry['expires'] < time.time():
+                debug(f'{self.name} cache entry for {key} expired.', level=1)
+                self._drop(name)
+                entry = None
+
+            if not entry or entry['key'] != key:
+                self.misses += 1
+                return default
+
+            self.memory[name] = entry
+            self.entries.move_to_end(name)
+            os.utime(os.path.join(self.path, name)) # Mark as recently used on disk as well
+            self.hits += 1
+
+            return entry['value']
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        """
+        Store a json serializable value, ttl overrides the cache's ttl for this entry
+        """
+
+        ttl = ttl if ttl is not None else self.ttl
+        name = self._file(key)
+        entry = {'key': key, 'expires': time.time() + ttl if ttl else None, 'value': value}
+        content = json.dumps(entry)
+
+        with self.lock:
+            # Write to a temporary file first so a crash can't leave half an entry
+            tmp = os.path.join(self.path, f'{name}.tmp')
+            with open(tmp, 'w') as f:
+                f.write(content)
+            os.replace(tmp, os.path.join(self.path, name))
+
+            self.size += len(content) - self.entries.get(name, 0)
+            self.entries[name] = len(content)
+            self.entries.move_to_end(name)
+            self.memory[name] = entry
+
+            # Evict the least recently used entries
+            while len(self.entries) > 1 and ((self.max_entries and len(self.entries) > self.max_entries) or (self.max_bytes and self.size > self.max_bytes)):
+                self._drop(next(iter(self.entries)))
+
+    def stats(self) -> str:
+        return f'{self.name} cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries ({formatBytes(self.size)})'
+
+def getCache(name: str, **kwargs) -> Cache:
+    """
+    Open a cache once and reuse it for the rest of the program
+    """
+
+    if name not in CACHES:
+        CACHES[name] = Cache(name, **kwargs)
+
+    return CACHES[name]
+
+class AudioBuffer:
+    """
+    Records the microphone continuously into a ring buffer,
+    audio samples are then read out of it so no audio is lost
+    while the program is waiting on the APIs
+    """
+
+    def __init__(self, seconds: int = 60, rate: int = 44100, channels: int = 1, device: int | str | None = None):
+        import numpy as np
+
+        self.rate = rate
+        self.channels = channels
+        self.size = int(seconds * rate) # Capacity of the buffer in frames
+        self.buffer = np.zeros((self.size, channels), dtype=np.int16) # Preallocated, the callback only ever writes into it
+        self.written = 0 # Total amount of frames written since the stream was started
+        self.last_read = 0 # The position (in frames written) the last read ended at
+        self.overflows = 0 # Amount of times the input stream reported a problem (counted here since the callback can't print)
+        self.level = None # The level of the last sample taken from this buffer in dBFS (before the gain), set by sampleAudio
+        self.ready = threading.Condition()
+
+        import sounddevice as sd
+
+        self.stream = sd.InputStream(samplerate=rate, channels=channels, dtype='int16', device=device, callback=self._callback)
+        self.stream.start()
+        debug(f'Started input stream with a {seconds} second ring buffer at {rate} Hz.')
+
+    def _callback(self, indata: 'np.ndarray', frames: int, time: Any, status: Any) -> None:
+        """
+        Called by sounddevice on its own thread with each block of audio
+        """
+
+        if status:
+            self.overflows += 1
+
+        with self.ready:
+            start = self.written % self.size
+            end = min(start + frames, self.size)
+            # Write the block, wrapping around to the start of the buffer if needed
+            self.buffer[start:end] = indata[:end - start]
+            self.buffer[:frames - (end - start)] = indata[end - start:]
+            self.written += frames
+            self.ready.notify_all()
+
+    def _grow(self, frames: int) -> None:
+        """
+        Grow the buffer so it can hold at least frames frames, keeping the audio already in it
+        """
+
+        import numpy as np
+
+        with self.ready:
+            kept = min(self.size, self.written)
+            # Absolute positions of the frames still in the buffer, oldest first
+            positions = np.arange(self.written - kept, self.written)
+            old = self.buffer[positions % self.size]
 
-    data_size = len(audio_data)
-    chunk_size = 36 + data_size
-    riff_chunk_size = chunk_size + 8
+            self.size = frames
+            self.buffer = np.zeros((self.size, self.channels), dtype=np.int16)
+            self.buffer[positions % self.size] = old
+
+        debug(f'Grew ring buffer to {frames / self.rate} seconds.')
+
+    def read(self, t: float, hop: float | None = None, out: 'np.ndarray | None' = None, stop: threading.Event | None = None) -> 'np.ndarray | None':
+        """
+        Return t seconds of audio ending hop seconds (by default t) after the end of
+        the last read, so consecutive samples never have a gap between them and
+        hop < t gives overlapping samples; if the reader fell more than a hop behind
+        it gets the last t seconds instead, returns None if stop is set while waiting
+        """
+
+        import numpy as np
+
+        frames = int(self.rate * t)
+        hop_frames = frames if hop is None else int(self.rate * hop)
+
+        if frames > self.size:
+            self._grow(frames)
+
+        if self.overflows:
+            debug(f'Input stream reported {self.overflows} overflow(s).', 'warning', '\x1b[33m')
+            self.overflows = 0
+
+        with self.ready:
+            # Wait in short steps so a keyboard interrupt isn't blocked
+            while self.written < frames or self.written - self.last_read < hop_frames:
+                if not self.stream.active:
+                    raise RuntimeError('The input stream stopped.')
+
+                if stop is not None and stop.is_set():
+                    debug('Stopped waiting for audio.')
+                    return None
+
+                self.ready.wait(0.1)
+
+            if out is None:
+                out = np.empty((frames, self.channels), dtype=np.int16)
+
+            # The audio comes in blocks, so more than hop frames may have been written by now
+            last = self.last_read + hop_frames
+            if not self.last_read or self.written - last >= hop_frames or self.written - last + frames > self.size:
+                last = self.written
+
+            end = last % self.size
+            start = end - frames
+            if start >= 0:
+                out[:] = self.buffer[start:end]
+            else:
+                # The sample wraps around the end of the buffer
+                out[:-start] = self.buffer[start:]
+                out[-start:] = self.buffer[:end]
+
+            self.last_read = last
+
+        return out
+
+    def close(self) -> None:
+        self.stream.stop()
+        self.stream.close()
+        debug('Closed input stream.')
+
+
+def wavBuffer(frames: int, rate: int, channels: int = 1, width: int = 2) -> Tuple[bytearray, 'np.ndarray']:
+    """
+    Preallocate a whole .wav file, returns the file and
+    a writable view of its samples so they can be filled in place
+    """
+
+    import numpy as np
+
+    data_size = frames * channels * width
+    audio_data = bytearray(44 + data_size)
 
     # .wav format headers (thanks Chat-GPT)
-    header = struct.pack(
+    struct.pack_into(
         '<4sI4s4sIHHIIHH4sI',
+        audio_data,
+        0,
         b'RIFF',
-        riff_chunk_size,
+        36 + data_size,
         b'WAVE',
         b'fmt ',
         16,
         1,
-        CHANNELS,
-        RATE,
-        RATE * CHANNELS * WIDTH,
-        CHANNELS * WIDTH,
-        WIDTH * 8,
+        channels,
+        rate,
+        rate * channels * width,
+        channels * width,
+        width * 8,
         b'data',
         data_size
     )
 
-    audio_data = header + audio_data
+    samples = np.frombuffer(audio_data, dtype=f'<i{width}', offset=44).reshape(frames, channels)
+
+    return audio_data, samples
+
+def sampleLevel(samples: 'np.ndarray') -> float:
+    """
+    The rms level of int16 samples in dBFS
+    """
+
+    import numpy as np
+
+    rms = np.sqrt(np.einsum('ij,ij->', samples, samples, dtype=np.float64) / max(samples.size, 1))
+    return 20 * np.log10(max(rms, 1) / 32768)
+
+def autoGain(samples: 'np.ndarray', target_rms: float = 3000, max_gain: float = 8) -> float:
+    """
+    Amplify int16 samples in place towards target_rms,
+    the gain is capped so the peak can never clip
+    """
+
+    import numpy as np
+
+    peak = max(int(samples.max()), -int(samples.min()), 1) # Python ints so -(-32768) can't wrap
+    rms = np.sqrt(np.einsum('ij,ij->', samples, samples, dtype=np.float64) / samples.size) # Sum of squares without an int16 copy
+
+    gain = min(max(target_rms / max(rms, 1), 1), max_gain, 32767 / peak)
+    debug(f'Audio rms: {rms:.1f}, peak: {peak}, gain: {gain:.2f}.', level=1)
+
+    if gain > 1:
+        # |sample| * gain <= peak * 32767 / peak, so the cast back to int16 can't overflow
+        np.multiply(samples, gain, out=samples, casting='unsafe')
+
+    return gain
+
+def hasMusic(samples: 'np.ndarray', rate: int, frame_ms: int = 50, min_db: float = -50, max_flatness: float = 0.45, min_loud: float = 0.25) -> bool:
+    """
+    Check if a sample could contain music from the short-time
+    energy and spectral flatness of its frames, silence fails the
+    energy check and noise (a flat spectrum) fails the flatness check
+    """
+
+    import numpy as np
+
+    x = samples.reshape(len(samples), -1)[:, 0]
+    frame = int(rate * frame_ms / 1000)
+    n = len(x) // frame
+    if n == 0:
+        return True
+
+    frames = x[:n * frame].reshape(n, frame).astype(np.float32) / 32768
+
+    # Energy of each frame in dBFS
+    energy = 10 * np.log10(np.einsum('ij,ij->i', frames, frames) / frame + 1e-12)
+    loud = energy > min_db
+    debug(f'Median energy: {np.median(energy):.1f} dBFS, loud frames: {loud.mean():.0%}.', level=1)
+
+    if loud.mean() < min_loud:
+        debug('Sample is silent.')
+        return False
+
+    # Spectral flatness (geometric mean / arithmetic mean of the power spectrum), ~0.56 for white noise
+    power = np.abs(np.fft.rfft(frames[loud] * np.hanning(frame).astype(np.float32), axis=1)) ** 2 + 1e-12
+    flatness = np.median(np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1))
+    debug(f'Median spectral flatness: {flatness:.2f}.', level=1)
+
+    if flatness > max_flatness:
+        debug('Sample is noise.')
+        return False
+
+    return True
+
+def captureRate(rate: int, device: int | str | None = None) -> int:
+    """
+    Return rate if the input device can record at it
+    natively, otherwise the device's default sample rate
+    """
+
+    import sounddevice as sd
+
+    try:
+        sd.check_input_settings(device=device, samplerate=rate, channels=1, dtype='int16')
+        debug(f'Input device supports {rate} Hz.')
+        return rate
+    except Exception:
+        default = int(sd.query_devices(device, 'input')['default_samplerate'])
+        debug(f'Input device does not support {rate} Hz, recording at {default} Hz.')
+        return default
+
+def resample(samples: 'np.ndarray', rate: int, new_rate: int, out: 'np.ndarray') -> None:
+    """
+    Resample mono int16 samples into out with a polyphase filter
+    """
+
+    import numpy as np
+    from scipy.signal import resample_poly
+
+    common = gcd(rate, new_rate)
+    resampled = resample_poly(samples.reshape(len(samples), -1)[:, 0], new_rate // common, rate // common)
+    np.clip(resampled, -32768, 32767, out=resampled)
+
+    # The filter output can be a sample longer than out
+    out[:, 0] = resampled[:len(out)]
+    out[len(resampled):] = 0
+
+def getAudioBuffer(device: int | str | None = None, rate: int = 16000) -> AudioBuffer:
+    """
+    The AudioBuffer of an input device, the stream
+    is started on the first call and stays open
+    """
+
+    if device not in AUDIO_BUFFERS:
+        AUDIO_BUFFERS[device] = AudioBuffer(rate=captureRate(rate, device), device=device)
+
+    return AUDIO_BUFFERS[device]
+
+def sampleAudio(t: int, gate: bool = True, device: int | str | None = None, stop: threading.Event | None = None) -> bytearray | None:
+    """
+    Get an audio sample of t seconds from an input device as a
+    .wav file in bytes, if gate is set samples that can't contain music return None,
+    as does setting stop while waiting for the audio
+    """
+
+    CHANNELS = 1
+    RATE = 16000 # The recognizer fingerprints 16 kHz mono, anything more is only uploaded to be thrown away
+    WIDTH = 2
+    RECORD_SECONDS = t
+
+    buffer = getAudioBuffer(device, RATE)
+
+    # The samples are written straight into the .wav file
+    audio_data, samples = wavBuffer(int(RATE * RECORD_SECONDS), RATE, CHANNELS, WIDTH)
+
+    # Every sample starts SAMPLE_OVERLAP seconds before the last one ended
+    hop = max(RECORD_SECONDS - SAMPLE_OVERLAP, RECORD_SECONDS / 2)
+
+    debug(f'Reading {RECORD_SECONDS} seconds of audio ({hop} seconds of it new).')
+    if buffer.rate == RATE:
+        if buffer.read(RECORD_SECONDS, hop, out=samples, stop=stop) is None:
+            return None
+    else:
+        audio = buffer.read(RECORD_SECONDS, hop, stop=stop)
+        if audio is None:
+            return None
+
+        resample(audio, buffer.rate, RATE, samples)
+        debug(f'Resampled audio from {buffer.rate} Hz to {RATE} Hz.')
+    debug('Got audio samples.')
+
+    buffer.level = sampleLevel(samples)
+
+    # Check before the gain is applied, since it would amplify the noise floor
+    if gate and not hasMusic(samples, RATE):
+        return None
+
+    autoGain(samples)
 
     debug(f'Audio data size: {formatBytes(len(audio_data))}.')
 
     return audio_data
 
+def densityLut(density: dict) -> 'np.ndarray':
+    """
+    The density character of each gray level (0..255), picked like
+    min(density.items(), key=...) picks it so ties go the same way
+    """
+
+    import numpy as np
+
+    key = tuple(density.items())
+    if key not in DENSITY_LUTS:
+        DENSITY_LUTS[key] = np.array([min(density.items(), key=lambda i: abs(level - i[1]))[0] for level in range(256)])
+        debug(f'Built density lookup table for {len(density)} characters.', level=1)
+
+    return DENSITY_LUTS[key]
+
+def detectColors() -> str:
+    """
+    Guess the colors the terminal can show from COLORTERM and TERM
+    """
+
+    colorterm = os.environ.get('COLORTERM', '').lower()
+    term = os.environ.get('TERM', '').lower()
+
+    if colorterm in ('truecolor', '24bit') or 'WT_SESSION' in os.environ:
+        colors = 'truecolor'
+    elif '256' in term:
+        colors = '256'
+    elif term:
+        colors = '16' # The console, screen, vt100 and plain xterm
+    else:
+        colors = 'truecolor' # Windows consoles don't set TERM
+
+    debug(f'Detected {colors} colors ({colorterm=}, {term=}).')
+    return colors
+
+def palette(colors: str) -> 'np.ndarray':
+    """
+    The RGB values of the palette colors codes can be made for (by index)
+    """
+
+    import numpy as np
+
+    if colors == '16':
+        return np.array(XTERM_16)
+
+    # The 6x6x6 color cube and the grays of the 256 color palette, the first 16 are
+    # left out since terminals change them (they are the same as the 16 color palette)
+    levels = [0, 95, 135, 175, 215, 255]
+    cube = [(r, g, b) for r in levels for g in levels for b in levels]
+    grays = [(8 + 10 * i,) * 3 for i in range(24)]
+
+    return np.array([(0, 0, 0)] * 16 + cube + grays)
+
+def paletteLut(colors: str) -> 'np.ndarray':
+    """
+    The nearest palette color of every 32x32x32 bin of RGB,
+    index it with the top 5 bits of each channel
+    """
+
+    import numpy as np
+
+    if colors not in PALETTE_LUTS:
+        colors_rgb = palette(colors).astype(np.int32)
+        first = 0 if colors == '16' else 16 # Never pick the changeable colors of the 256 color palette
+        centers = np.arange(32) * 8 + 4
+        bins = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        lut = np.empty(len(bins), dtype=np.uint8)
+        for start in range(0, len(bins), 4096):
+            # In chunks, so the distance matrix stays small
+            distances = ((bins[start:start + 4096, None, :] - colors_rgb[None, first:, :]) ** 2).sum(axis=2)
+            lut[start:start + 4096] = distances.argmin(axis=1) + first
+
+        PALETTE_LUTS[colors] = lut.reshape(32, 32, 32)
+        if colors == '16':
+            PALETTE_CODES[colors] = (np.array([f'\x1b[{30 + i if i < 8 else 82 + i}m' for i in range(16)]), np.array([f'\x1b[{40 + i if i < 8 else 92 + i}m' for i in range(16)]))
+        else:
+            PALETTE_CODES[colors] = (np.array([f'\x1b[38;5;{i}m' for i in range(256)]), np.array([f'\x1b[48;5;{i}m' for i in range(256)]))
+        debug(f'Built {colors} color lookup table.', level=1)
+
+    return PALETTE_LUTS[colors]
+
+def colorCodes(rgb: 'np.ndarray', fg: bool = True) -> 'np.ndarray | list':
+    """
+    The ansi color code of every pixel of an RGB image (rows of
+    lists of strings), in the colors the terminal can show (COLORS)
+    """
+
+    import numpy as np
+
+    if COLORS == 'truecolor':
+        return [[f'\x1b[{"38" if fg else "48"};2;{r};{g};{b}m' for r, g, b in row] for row in rgb.tolist()]
+
+    rgb = np.asarray(rgb, dtype=np.uint8) >> 3
+    index = paletteLut(COLORS)[rgb[..., 0], rgb[..., 1], rgb[..., 2]]
+
+    return PALETTE_CODES[COLORS][0 if fg else 1][index].tolist()
+
+def colorCode(rgb: tuple, fg: bool = True) -> str:
+    """
+    The ansi color code of a single color, in the colors the terminal can show (COLORS)
+    """
+
+    if COLORS == 'truecolor':
+        # Without numpy, the metadata is colored even when nothing else needs it
+        return f'\x1b[{"38" if fg else "48"};2;{rgb[0]};{rgb[1]};{rgb[2]}m'
+
+    import numpy as np
+
+    return colorCodes(np.array([[rgb]]), fg)[0][0]
+
+def asciiArt(im: 'Image.Image', density: dict, s: int) -> str:
+    """
+    Render an image as s rows of ascii art with ansi color codes
+    """
+
+    import numpy as np
+    from PIL import Image
+
+    im = im.resize((s * 2, s), Image.Resampling.LANCZOS) # Resize to 2x width since text characters are about 2x taller than they are wide
+    debug('Resized image.')
+    mono = np.asarray(im.convert('L')) # The image in monochrome (for the density)
+    debug('Converted image clone to monochrome.')
+    rgb = np.asarray(im.convert('RGB')) # Ensure the image is in RGB
+    debug('Converted image to RGB.')
+
+    chars = densityLut(density)[mono] # The character from the density map, for every pixel at once
+    codes = colorCodes(rgb) # The color code of every pixel, at once as well unless the terminal can show any color
+    img = [ansiRow(row_chars, row_codes) for row_chars, row_codes in zip(chars.tolist(), codes)]
+    debug(f'Converted {len(img)} rows to ascii.', level=1)
+
+    return '\n'.join(img)
+
+def ansiRow(chars: list, codes: list) -> str:
+    """
+    Encode a row of characters with their color codes, bold is set once
+    for the row and a color only when it differs from the one before it
+    """
+
+    row = ['\x1b[1m']
+    last = None
+    for char, code in zip(chars, codes):
+        if code != last:
+            row.append(code)
+            last = code
+
+        row.append(char)
+
+    row.append('\x1b[0m')
+    return ''.join(row)
+
 def coverArtToText(image: str, density: dict, s: int) -> Tuple[str, tuple]:
     """
     Convert an image to ascii art with ansi color codes
     """
-    
+
+    import numpy as np
+    from PIL import Image
+    from spotify_background_color import SpotifyBackgroundColor
+
     debug('Getting ascii cover art from image.')
     im = Image.open(image)
     debug('Opened image.')
 
     try:
-        dc = SpotifyBackgroundColor(np.array(im)).best_color()
+        # Covers are often 1000x1000, the fast engine only clusters a sample of their pixels
+        dc = SpotifyBackgroundColor(np.array(im)).best_color(fast=COLOR_ENGINE == 'fast')
         debug(f'Got background color: {dc}.')
     except Exception:
         debug('Failed to get background color. Using white as default.', 'error', '\x1b[31m')
         dc = (255, 255, 255)
-        
-    im = im.resize((s * 2, s), Image.Resampling.LANCZOS) # Resize to 2x width since text characters are about 2x taller than they are wide
-    debug('Resized image.')
-    mono = im.convert('L') # Get a clone of the image in monochrome (for the density)
-    debug('Converted image clone to monochrome.')
-    im = im.convert('RGB') # Ensure the image is in RGB
-    debug('Converted image to RGB.')
-    
-    img = []
-    tmp = ''
-    
-    for y in range(im.height):
-        for x in range(im.width):
-            mono_pixel = mono.getpixel((x, y))
-            r, g, b = im.getpixel((x, y))
-            
-            density_char, _ = min(density.items(), key=lambda i: abs(mono_pixel - i[1])) # The character from the density map
-            tmp += f"\x1b[1m\x1b[38;2;{r};{g};{b}m{density_char}\x1b[0m" # Combine the RGB and density character (this is one character)
-        
-        img.append(tmp)
-        debug(f'Converted row {y + 1} to ascii.', level=1)
-        tmp = ''
-    
+
+    cover = asciiArt(im, density, s)
     debug('Got ascii cover art from image.')
 
-    return '\n'.join(img), dc
+    return cover, dc
 
 def finish():
     """
     Stop the program and save any log files
     """
+
+    for buffer in AUDIO_BUFFERS.values():
+        buffer.close()
     
     if LOG_PATH:
         with open(LOG_PATH, 'w') as f:
@@ -0,0 +1,138 @@
+from resources import debug
+from collections import deque
+import contextlib
+from typing import Any, Callable
+import threading
+import asyncio
+import random
+import time
+
+"""
+Retry policies shared by every call to an upstream API,
+so a flaky upstream gets backed off from instead of hammered.
+"""
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream while its circuit breaker is open
+    """
+
+class RetryPolicy:
+    """
+    Retries failed calls with jittered exponential backoff, keeps
+    to a per-minute request budget and opens a circuit breaker after
+    too many failures in a row; while it is open calls fail right
+    away, after reset_after seconds a single trial call is let trough
+    """
+
+    def __init__(self, name: str, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30, budget: int = 60, failure_threshold: int = 5, reset_after: float = 30):
+        self.name = name
+        self.attempts = attempts # Calls made before giving up, including the first
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget # The maximum amount of requests in any minute
+        self.failure_threshold = failure_threshold # Failures in a row that open the breaker
+        self.reset_after = reset_after # Seconds the breaker stays open
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0
+        self.requests = deque() # Times of the requests in the last minute
+        self.lock = threading.Lock() # Policies are used from worker threads as well
+
+    def _acquire(self) -> float:
+        """
+        Check the breaker and the budget before a request, returns
+        how long to wait before making it (0 if it can be made now)
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            if self.state == 'half-open':
+                raise CircuitOpenError(f'{self.name} circuit breaker is half-open, waiting on the trial request.')
+
+            if self.state == 'open':
+                if now - self.opened_at < self.reset_after:
+                    raise CircuitOpenError(f'{self.name} circuit breaker is open, retrying in {self.reset_after - (now - self.opened_at):.0f} seconds.')
+
+                self.state = 'half-open'
+                debug(f'{self.name} circuit breaker is half-open, sending a trial request.', 'warning', '\x1b[33m')
+
+            while self.requests and now - self.requests[0] > 60:
+                self.requests.popleft()
+
+            if len(self.requests) >= self.budget:
+                return self.requests[0] + 60 - now
+
+            self.requests.append(now)
+            return 0
+
+    def _success(self) -> None:
+        with self.lock:
+            if self.state != 'closed':
+                debug(f'{self.name} circuit breaker closed.', 'warning', '\x1b[33m')
+
+            self.state = 'closed'
+            self.failures = 0
+
+    def _failure(self, e: Exception) -> None:
+        with self.lock:
+            self.failures += 1
+            debug(f'{self.name} request failed ({self.failures} in a row): {e}', 'warning', '\x1b[33m')
+
+            if self.state == 'half-open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                debug(f'{self.name} circuit breaker opened for {self.reset_after} seconds.', 'error', '\x1b[31m')
+
+    def _cancelled(self) -> None:
+        with self.lock:
+            if self.state == 'half-open':
+                # The trial request never finished, let the next call make one
+                self.state = 'open'
+                self.opened_at = time.monotonic() - self.reset_after
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full jitter: a random delay up to base_delay * 2^attempt
+        """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, func: Callable, *args, limiter: asyncio.Semaphore | None = None, **kwargs) -> Any:
+        """
+        Await func(*args, **kwargs) under the policy, limiter is only held
+        while the request is made (not while waiting on the budget or backoff)
+        """
+
+        for attempt in range(self.attempts):
+            while (wait := self._acquire()) > 0:
+                debug(f'{self.name} request budget used up, waiting {wait:.1f} seconds.', 'warning', '\x1b[33m')
+                await asyncio.sleep(wait)
+
+            try:
+                async with limiter or contextlib.nullcontext():
+                    result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self._cancelled()
+                raise
+            except Exception as e:
+                self._failure(e)
+                if attempt == self.attempts - 1 or self.state == 'open':
+                    raise
+
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            self._success()
+            debug(self.stats(), level=1)
+            return result
+
+    def stats(self) -> str:
+        return f'{self.name}: breaker {self.state}, {self.failures} failures in a row, {len(self.requests)}/{self.budget} requests in the last minute'
+
+SHAZAM_BUDGET = 40 # Shazam requests per minute for each input, sngfetch scales it with the amount of --sources
+
+POLICIES = {
+    'shazam': RetryPolicy('shazam', budget=SHAZAM_BUDGET),
+    'deezer': RetryPolicy('deezer', budget=300),
+}
@@ -0,0 +1,114 @@
+from resources import debug
+import time
+
+"""
+Schedulers decide the duration of each audio sample
+song.Data takes and when it should give up.
+"""
+
+class FixedScheduler:
+    """
+    The original schedule: timeout // duration samples of the same
+    duration, the last few are longer unless the linear flag is passed
+    """
+
+    def __init__(self, timeout: int = 20, duration: int = 2, increase: int = 0, inf: bool = False, linear: bool = False):
+        self.isinfinite = timeout == -1 # If the search has no timeout limit
+        self.threshold = timeout // duration # The amount of iterations done
+        self.threshold += increase * self.threshold
+        self.timeout = timeout
+        self.duration = duration # The duration of each iteration
+        self.inc = increase # The increase of duration on each iteration
+        self.inf = inf # True if the continuous flag is passed
+        self.linear = linear # True if the linear flag is passed, causes the length to not increase at the last few iterations
+        self.status = 'Listening...' # Shown in the progress line
+
+    def next(self, itr: int) -> float | None:
+        """
+        Return the duration of sample number itr, or
+        None if there shouldn't be any more samples
+        """
+
+        if not self.isinfinite and itr >= max(self.threshold, 1):
+            return None
+
+        self.status = 'Listening...'
+        if not self.inf and not self.isinfinite and not self.linear:
+            if itr == self.threshold - 1:
+                # Last try; with a longer duration
+                self.status = 'Last try...'
+                self.duration += 3
+                debug(f'Last try, with a longer duration ({self.duration}).')
+
+            elif itr >= self.threshold - 4:
+                # Trying harder; with longer durations
+                self.status = 'Trying harder...'
+                self.duration += 1
+                debug(f'Trying harder, with a longer duration ({self.duration}).')
+
+        return self.duration
+
+    def observe(self, level: float | None = None, latency: float | None = None, matched: bool | None = None) -> None:
+        """
+        Feedback from song.Data: the level of the last sample in dBFS,
+        the latency of the last request in seconds and whether it matched
+        """
+
+        pass
+
+class AdaptiveScheduler(FixedScheduler):
+    """
+    Picks each sample's duration from the level of the last sample,
+    the amount of failed attempts and the recognizer's latency, and
+    stops when timeout seconds of wall-clock time are used up
+    """
+
+    MAX_DURATION = 10 # The recognizer doesn't fingerprint more than this
+    QUIET_LEVEL = -35 # Samples quieter than this (in dBFS) have less peaks to match, so they get longer
+
+    def __init__(self, timeout: int = 20, duration: int = 2, increase: int = 0, inf: bool = False, linear: bool = False):
+        super().__init__(timeout, duration, increase, inf, linear)
+        self.threshold = None # The amount of samples depends on how long each one takes
+        self.start = time.monotonic()
+        self.level = None
+        self.latency = None
+        self.failures = 0
+
+    def next(self, itr: int) -> float | None:
+        remaining = self.timeout - (time.monotonic() - self.start)
+        if not self.isinfinite and remaining <= 0 and itr > 0:
+            return None
+
+        # A second longer for every sample that didn't match
+        duration = self.duration + self.failures
+        if self.level is not None and self.level < self.QUIET_LEVEL:
+            duration += 2
+
+        # Samples shorter than a request would just pile up requests
+        if self.latency:
+            duration = max(duration, self.latency)
+
+        duration = min(duration, self.MAX_DURATION)
+        if not self.isinfinite:
+            duration = min(duration, max(remaining, 1))
+
+        self.status = 'Trying harder...' if self.failures else 'Listening...'
+        debug(f'Next sample is {duration:.1f} seconds ({self.failures=}, {self.level=}, {self.latency=}).', level=1)
+
+        return duration
+
+    def observe(self, level: float | None = None, latency: float | None = None, matched: bool | None = None) -> None:
+        if level is not None:
+            self.level = level
+
+        if latency is not None:
+            # Smoothed so one slow request doesn't change the schedule much
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+
+        if matched is False:
+            self.failures += 1
+
+SCHEDULERS = {
+    'fixed': FixedScheduler,
+    'adaptive': AdaptiveScheduler,
+}
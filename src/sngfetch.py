@@ -2,19 +2,25 @@ import song
 from io import BytesIO
 import resources # Custom library for small functions and global variables
 from resources import debug, finish, db_print
-import requests
+import net
+import retry
 from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import argparse
+import multiprocessing
 import os
 from lyrics import Lyrics
-from time import sleep
 import json
+import base64
 
 # Versioning
 # Major revision (new UI, lots of new features, conceptual change, etc.), Minor revision (maybe a change to a search box, 1 feature added, collection of bug fixes), Bug fix release
 VERSION = '2.5.3'
 
+COVER_CACHE = {'max_bytes': 64 * 1024 * 1024} # Options of the cache of downloaded cover art, by url
+RENDER_CACHE = {'max_bytes': 32 * 1024 * 1024} # Options of the cache of rendered cover art and its color, by url, size and minimalist level
+
 # Add arguments
 parser = argparse.ArgumentParser(description='Sngfetch: get song details in the command line.')
 parser.add_argument('-v', '--version', action='version', version=f'%(prog)s v{VERSION}')
@@ -24,101 +30,46 @@ parser.add_argument('-cd', '--continuous-until-different', type=int, nargs='?',
 parser.add_argument('-c', '--continuous', type=int, nargs='?', help='Keep searching even after a song is found, you can specify the delay between searches after the flag, stop by keyboard interrupt.', const=0)
 parser.add_argument('-hi', '--history', type=str, nargs='?', help='Show the history of fetched songs or a specific song by title.', const='')
 parser.add_argument('-hic', '--history-clear', action='store_true', help='Clear all the history of fetched songs.')
+parser.add_argument('--history-refresh', action='store_true', help='Get the Deezer data again for the songs in history that are missing it.')
 parser.add_argument('-m', '--minimalist', type=int, nargs='?', help='Display data in a more minimal style the amount of data can be controlled with an integer (0..2) after the flag.', const=0, default=-1)
 parser.add_argument('-r', '--remove', help="Remove a song from the history by it's title.")
 parser.add_argument('-d', '--duration', type=int, help='The default duration of each audio sample to be taken in seconds.', default=3)
 parser.add_argument('-t', '--total', type=int, help='The total amount of time to listen for in seconds.', default=30)
 parser.add_argument('-inc', '--increase', type=int, help='Increase the duration of each audio sample to be taken in seconds.', default=0)
 parser.add_argument('-i', '--infinite', action='store_true', help='Keep trying until interrupted.')
+parser.add_argument('--no-gate', action='store_true', help="Send every audio sample to the API, even the ones that can't contain music (silence, noise).")
+parser.add_argument('--scheduler', choices=['fixed', 'adaptive'], help='How the duration of each audio sample is picked, adaptive uses the audio level, failed attempts and API latency and treats --total as a time limit.', default='fixed')
 parser.add_argument('--linear', action='store_true', help='The length of each audio sample stays the same even in the last few tries.')
+parser.add_argument('--sources', nargs='+', help='Monitor several input devices (by index or name) at once, printing a line for each new song on each of them.')
+parser.add_argument('--max-requests', type=int, help='The maximum amount of recognition requests in flight across all --sources.', default=4)
+parser.add_argument('--shazam-budget', type=int, help='The maximum amount of Shazam requests per minute (default: 40 for each of the --sources).')
+parser.add_argument('-f', '--files', nargs='+', help='Recognize audio files (or directories of them) instead of the microphone.')
+parser.add_argument('--workers', type=int, help='The amount of processes fingerprinting files in --files mode (default: one per cpu).')
+parser.add_argument('--concurrency', type=int, help='The maximum amount of files being recognized (--files) or songs refreshed (--history-refresh) at the same time.', default=4)
 parser.add_argument('-s', '--size', type=int, help='The size of the cover art.', default=20)
+parser.add_argument('--colors', choices=['auto', 'truecolor', '256', '16'], help='The colors the terminal can show, auto guesses from $COLORTERM and $TERM.', default='auto')
+parser.add_argument('--color-engine', choices=['fast', 'full'], help='How the background color of the cover art is found, fast clusters a sample of the pixels and full all of them (slow).', default='fast')
+parser.add_argument('--cache-only', action='store_true', help='Only use cached Deezer data, never call the Deezer API.')
+parser.add_argument('--hedge', type=float, nargs='?', help="Also search Deezer for the song if its ISRC lookup hasn't answered after this many seconds (default: 0.3), the first usable answer is used.", const=0.3)
 parser.add_argument('--debug', action='store_true', help='Debug mode.')
 parser.add_argument('-ve', '--verbosity', type=int, help='Set the verbosity level of debug (will only have affect if debug is on).', default=0)
 parser.add_argument('--disable-stdout', action='store_true', help='Disable stdout and remove it from log.')
 parser.add_argument('--log', action='store_true', help='Log all the output in sngfetch_i.log in the current directory (recommended to use in conjunction with disable-stdout).')
 parser.add_argument('--freeze', type=str, help='Freeze basic song data to specified json file.')
-args = parser.parse_args()
+args = None # Parsed by main(), so importing this module doesn't parse argv or configure resources
 
 # The path to the file that stores the genius api credentials
 genius_api_path = os.path.join(os.path.expanduser('~'), 'genius.api')
 
-if args.debug:
-    # Turn on debugging and set the debug level
-    resources.DEBUG = True
-    resources.DEBUG_LEVEL = args.verbosity
-
-else:
-    resources.DEBUG = False # Ensure that the debug mode is off (although it should be off already).
-    resources.DEBUG_LEVEL = 0
-
-# Control the level of content to be shown (higher level = less content)
-resources.MINIMALIST_LEVEL = args.minimalist
-
-debug(f'Initialized arguments.')
-debug(args, level=1)
-
-if args.freeze:
-    # Write all song history into a json file
-    debug(f'Freezing to file {args.freeze}.')
-
-    tracks = song.History().get() # Get all the tracks as a list of dictionaries
-    debug(f'Loaded {tracks=}', level=2)
-    
-    # Put the tracks into key value pairs
-    # with the key being the song title
-    data = {item['title']: {key: value for key, value in item.items() if key != 'title'} for item in tracks}
-    debug(f'Loaded {data=}', level=2)
-
-    # Save json
-    with open(args.freeze, 'w') as f:
-        debug('Writing to file...')
-        json.dump(data, f, indent=4)
-
-    debug(f'Written to {args.freeze} successfully.')
-
-    finish() # A function that exits the program but before doing it saves any log files
-
-if args.log:
-    debug('Logging to file enabled.')
-    i = 0
-    debug('Finding debug log file path.')
-    # Find a valid name for the log
-    # file, with the format 'sngfetch_int.log'
-    while os.path.exists(os.path.join(os.getcwd(), f'sngfetch_{i}.log')):
-        i += 1
-    
-    log = os.path.join(os.getcwd(), f'sngfetch_{i}.log')
-    debug(f'Found debug log file path: {log}.')
-    resources.LOG_PATH = log
-else:
-    debug('Logging to file disabled.')
-
-if args.disable_stdout:
-    debug('Disabled print.')
-    resources.DISABLE_STDOUT = True
-    
-if args.lyrics_setup:
-    debug('Lyrics setup.')
-    # Check if the API credentials are
-    # present and exit the program if they are
-    Lyrics.ensureAPIcreds(genius_api_path)
-    # The credentials aren't present since the program hasn't exited
-    if input('API credentials already exist, remove them [y/N]: ') == 'y':
-        os.remove(genius_api_path)
-        Lyrics.ensureAPIcreds(genius_api_path) # Create the file and ask the user to open it
-
-    db_print('Doing nothing.')
-    finish()
-
-def printNext(s: str, w: int, end: str = '\n') -> None:
+def printNext(s: str, w: int, left: str = '') -> str:
     """
-    Print a string next to another; used when
-    printing the metadata next to the cover art
+    Return a line with a string next to another; used
+    when putting the metadata next to the cover art
     
     It goes as far left as possible to ensure 
     that the correct width is set after going right
     """
-    db_print(f'\x1b[99999999D\x1b[{w}C{s}', end=end, no_clear=True)
+    return f'{left}\x1b[99999999D\x1b[{w}C{s}'
 
 def color(s: str, rgb: tuple, bold: bool = True, fg: bool = True) -> str:
     """
@@ -126,11 +77,9 @@ def color(s: str, rgb: tuple, bold: bool = True, fg: bool = True) -> str:
     specified rgb color using ansi
     """
     
-    r, g, b = rgb
+    return f'{"\x1b[1m" if bold else ""}{resources.colorCode(rgb, fg)}{s}\x1b[0m'
 
-    return f'{"\x1b[1m" if bold else ""}\x1b[{"38" if fg else "48"};2;{r};{g};{b}m{s}\x1b[0m'
-
-cover_size = args.size
+cover_size = 20 # Set from args by main()
 
 def lambdaCounter(func: Callable):
     # Works as a wrapper to a lambda function
@@ -147,18 +96,91 @@ def lambdaCounter(func: Callable):
     wrapper.count = 0
     return wrapper
 
-def display(data):
+def lyricsSearch(title: str, artists: str | list) -> str:
+    """
+    The Genius search string for a song
+    """
+
+    # Strip the title by removing any (feat. ...) and get
+    # the first artist (main artist), since this is what Genius search supports
+    return f'{title.split('(')[0].strip()} {''.join(artists).strip().split(',')[0]}'
+
+async def coverImage(url: str) -> bytes:
+    """
+    The cover art image at url, from the cover cache if it was downloaded before
+    """
+
+    covers = resources.getCache('covers', **COVER_CACHE)
+    content = covers.get(url)
+    debug(f'Cover cache {"hit" if content else "miss"} for {url} ({covers.stats()}).')
+    if content:
+        return base64.b64decode(content)
+
+    content = await net.CLIENT.get(url, 'bytes')
+    covers.set(url, base64.b64encode(content).decode('utf-8'))
+    debug(f'Got cover art from {url}.')
+
+    return content
+
+async def enrich(track: dict) -> dict:
+    """
+    Get the cover art and the lyrics of a song straight from its Shazam track,
+    song.Data runs this alongside the Deezer lookups so display doesn't have to
+    wait on them one after another, anything that fails is left for display to retry
+    """
+
+    jobs = {}
+    cover_url = track.get('images', {}).get('coverart')
+    if args.minimalist < 1 and cover_url:
+        jobs['cover'] = coverImage(cover_url)
+
+    if args.lyrics:
+        title = track.get('title', 'Unknown')
+        jobs['lyrics'] = Lyrics.getFromTitle(lyricsSearch(title, track.get('subtitle', '')), title, genius_api_path, quiet=True)
+
+    debug(f'Enriching {track.get("title")} with {list(jobs)}.')
+    results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+    extras = {}
+    for name, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            debug(f'Unable to get {name}: {result}', 'warning', '\x1b[33m')
+        else:
+            extras[name] = result
+
+    if cover_url and 'cover' in extras:
+        extras['cover_url'] = cover_url # display only uses the cover if it is the one in the data
+
+    return extras
+
+def enricher() -> Callable | None:
+    """
+    The enrich function to pass to song.Data, None if display doesn't need anything from it
+    """
+
+    if args.minimalist >= 1 and not args.lyrics:
+        return None
+
+    if args.lyrics:
+        # Asked for now instead of in the middle of showing a song
+        Lyrics.ensureAPIcreds(genius_api_path)
+
+    return enrich
+
+async def display(data, extras: dict | None = None):
     """
     Displays the data in a nice format; cover art
-    with metadata lines next to it
+    with metadata lines next to it, extras holds
+    anything enrich already got for the song
     """
 
+    extras = extras or {}
+
     debug(f'Displaying data for {data["title"]} by {data["artists"]}.')
     debug(f'Getting cover art from {data["cover"]}.')
     debug(f'Using data: {data}', level=1)
     # Set some default values in case any
     # are missing (THESE ARE NEEDED)
-    response = None
+    content = b'' # Cover art image
     w = 0 # Cover art width
     dc = (255, 255, 255) # Dominant color
     cover = '\n' * cover_size # Cover art string
@@ -169,73 +191,47 @@ def display(data):
         # (or off), but we still need the dominant color for the
         # minimalist level 0
 
-        if data['cover']:
+        # The rendered cover art is the same every time the same song (or album) is shown
+        renders = resources.getCache('renders', **RENDER_CACHE)
+        render_key = f'{data["cover"]}|{cover_size}|{args.minimalist}|{args.color_engine}|{resources.COLORS}'
+        render = renders.get(render_key) if data['cover'] else None
+        debug(f'Render cache {"hit" if render else "miss"} for {render_key} ({renders.stats()}).')
+
+        if render:
+            cover, dc = render['cover'], tuple(render['dc'])
+
+        elif data['cover'] and extras.get('cover_url') == data['cover']:
+            content = extras['cover']
+            debug(f'Using the cover art enrich got.')
+
+        elif data['cover']:
             # data['cover'] holds the url to the cover art
-            response = requests.get(data['cover'])
-            debug(f'Got cover art from {data["cover"]}.')
+            try:
+                content = await coverImage(data['cover'])
+            except Exception as e:
+                debug(f'Unable to get cover art: {e}', 'warning', '\x1b[31m')
         
         else:
             debug('Unable to get cover art.', 'warning', '\x1b[31m')
 
-        density = {
-                'Ñ': 255,
-                '@': 245,
-                '#': 235,
-                'W': 225, 
-                '$': 215, 
-                '9': 205, 
-                '8': 195, 
-                '7': 185, 
-                '6': 175, 
-                '5': 165, 
-                '4': 155, 
-                '3': 145, 
-                '2': 135, 
-                '1': 125, 
-                '0': 115, 
-                '?': 105, 
-                '!': 95, 
-                'a': 85, 
-                'b': 75, 
-                'c': 65, 
-                ';': 55, 
-                ':': 50, 
-                '+': 45, 
-                '=': 40, 
-                '-': 35,
-                '*': 20,
-                ',': 10,
-                '.': 5,
-                  }
-        
-        if response.content:
+        if content:
             debug('Converting cover art to text.')
             # Convert the cover art image to an ascii (text) image
-            cover, dc = resources.coverArtToText(BytesIO(response.content), density, cover_size) # Returns the cover art string and dominant color of the artwork
+            cover, dc = resources.coverArtToText(BytesIO(content), resources.DENSITY, cover_size) # Returns the cover art string and dominant color of the artwork
+            renders.set(render_key, {'cover': cover, 'dc': list(dc)})
             debug('Converted cover art to text.')
         
-    if args.minimalist < 0:
-        # Display the cover art only when minimalist
-        # is off, hence the minimalist level is -1
-        db_print(cover)
-
-        # Get ready to print the other stuff
-        # Put the cursor back up
-        db_print(f'\x1b[{len(cover.splitlines()) + 1}A')
-
-        w = cover_size * 2 + 1
-
-    if args.minimalist >= 0:
-        # Clear the line with (i/j) Listening... on it
-        # if minimalist is not off (otherwise the cover art clears that)
-        db_print('\x1b[2K\x1b[A')
+    # The whole screen is put together first and written at
+    # once, so it doesn't flicker in while it is printed
+    frame = resources.Frame()
+    lines = [] # The metadata lines
 
     # Title
-    printNext(color(data['title'], dc), w)
-    printNext('-' * len(data['title']), w)
+    lines.append(color(data['title'], dc))
+    lines.append('-' * len(data['title']))
 
     # Metadata
-    md = lambda n, s: printNext(f'{color(n, dc)}: {s}', w)
+    md = lambda n, s: lines.append(f'{color(n, dc)}: {s}')
     md = lambdaCounter(md) # Call count wrapper
 
     md(f'Artist', data['artists'])
@@ -243,7 +239,7 @@ def display(data):
     md('Label', data['label'])
     md('Genre', data['genre'])
     md('Duration', data['duration'])
-    md('Popularity', f'#{int(data['popularity']):,}' if data['popularity'] else 'Unknown')
+    md('Popularity', f'#{int(data['popularity']):,}' if str(data['popularity']).isdigit() else 'Unknown') # 'Unknown' without Deezer data (--cache-only)
     md('Released', data['release_date'] if data['release_date'] else 'Unknown')
     md('Explicit', 'Yes' if data['explicit'] else 'No')
     md('ISRC', data['isrc'])
@@ -252,15 +248,23 @@ def display(data):
     md('Link', data['link'])
 
     if args.minimalist < 0:
-        # Fill the rest of the space with empty
-        # lines if the cover art was displayed
-        for _ in range(cover_size - md.count - 2):
-            printNext('', w)   
+        # Display the cover art only when minimalist is off, hence
+        # the minimalist level is -1, with the metadata next to each
+        # of its lines and empty lines filling the rest of the space
+        cover_lines = cover.splitlines()
+        w = cover_size * 2 + 1
+
+        for i in range(max(len(cover_lines), len(lines), cover_size)):
+            frame.print(printNext(resources.getIndex(i, lines, ''), w, resources.getIndex(i, cover_lines, '')))
 
-        debug(f'Displayed {md.count} metadata lines and {cover_size - md.count - 2} empty lines.')
+        debug(f'Displayed {md.count} metadata lines and {max(len(cover_lines), cover_size) - md.count - 2} empty lines.')
     
     else:
-        printNext('', w)
+        # The first line clears the line with (i/j) Listening... on it
+        # if minimalist is not off (otherwise the cover art clears that)
+        for line in lines + ['']:
+            frame.print(line)
+
         debug(f'Displayed {md.count} metadata lines.')
 
     if args.lyrics:
@@ -268,23 +272,232 @@ def display(data):
         try:
             debug(f'Getting lyrics.')
             # Try to get the lyrics of the song by its title and
-            # main artist since this is what Genius search supports
-
-            # Strip the title by removing any (feat. ...) and get
-            # the first artist (main artist), also provide the full
-            # title which the user will see if the search fails and
-            # the path to the Genius API credentials
-            lyrics = Lyrics.getFromTitle(f'{data["title"].split('(')[0].strip()} {''.join(data["artists"]).strip().split(',')[0]}', data["title"], genius_api_path)
+            # main artist, also provide the full title which the
+            # user will see if the search fails and the path to
+            # the Genius API credentials
+            if 'lyrics' in extras:
+                lyrics = extras['lyrics']
+                if not lyrics:
+                    frame.print(f"Unable to fetch lyrics for '{data['title']}'.")
+            else:
+                frame.flush() # Show the song while its lyrics are fetched
+                lyrics = await Lyrics.getFromTitle(lyricsSearch(data['title'], data['artists']), data["title"], genius_api_path)
             # 'lyrics' is a list containing the full lyrics and the url to the lyrics
             if lyrics:
                 debug('Got lyrics successfully.')
-                db_print(lyrics[0]) # full lyrics
-                db_print(f'({lyrics[1]})\n') # url
+                frame.print(lyrics[0]) # full lyrics
+                frame.print(f'({lyrics[1]})\n') # url
         except KeyboardInterrupt:
             debug('Keyboard interrupt.')
-            db_print('\nExiting...')
+            frame.print('\nExiting...')
+
+    frame.flush()
+
+async def recognizeFiles():
+    """
+    Recognize the files passed with --files,
+    displaying each one as soon as it is done
+    """
+
+    batch = song.Batch(args.files, args.workers, args.concurrency)
+    recognized = 0
+    async for path, data in batch.run():
+        if data:
+            recognized += 1
+            db_print(f'\x1b[2K{path}')
+            await display(data)
+        else:
+            db_print(f"\x1b[2KCouldn't recognize '{path}'.")
+
+    db_print(f'\nRecognized {recognized} of {len(batch.paths)} files.')
+
+def newData(inf: bool, shazam, device: int | str | None = None, limiter: asyncio.Semaphore | None = None, tag: str = '', enrich: Callable | None = None) -> song.Data:
+    """
+    Create a song.Data object from the arguments, inf
+    signals to Data that the program is in continuous mode
+    """
+
+    # Get the data from song.Data trough the microphone with arguments:
+    #   - args.total => the total amount of time the program will (at least try to (this is not the exact amount of time because of
+    #     args.duration and increases in time at the last few tries, these are avoidable with the --linear flag)) listen for in seconds
+    #     (-1 when args.infinite is set, so it never times out)
+    #
+    #   - args.duration => is the duration of each audio segment taken in seconds
+    #
+    #   - args.increase => the amount the duration increases each time in seconds (default=0)
+    timeout = args.total if not args.infinite else -1
+    debug(f'{tag}Started fetching song data with args {(timeout, args.duration, args.increase, inf, args.linear, not args.no_gate, args.scheduler, device)}.')
+
+    return song.Data(timeout, args.duration, args.increase, inf, args.linear, not args.no_gate, shazam, args.scheduler, device, limiter, tag, enrich)
+
+async def fetch() -> None:
+    """
+    Fetch and display a single song
+    """
+
+    shazam = song.shazamClient()
+    try:
+        fetcher = newData(False, shazam, enrich=enricher())
+        data = await fetcher.get()
+        debug('Fetched song data successfully.')
+        await display(data, fetcher.extras)
+    finally:
+        await shazam.http_client.close()
+
+async def listen(delay: int, only_different: bool = False) -> None:
+    """
+    Fetch songs until interrupted, all inside of one event loop with
+    one Shazam client so the session and its connections are reused
+    """
+
+    shazam = song.shazamClient()
+    enrich = enricher()
+    last_data = None # Data dict of the last song
+    last_key = None # Shazam's track key of the last song shown
+
+    async def enrichNew(track: dict) -> dict:
+        # The song that is still playing won't be shown again, so
+        # its cover art and lyrics don't have to be fetched again
+        if only_different and last_key is not None and track.get('key') == last_key:
+            debug(f'Not enriching {track.get("title")}, it was shown last.')
+            return {}
+
+        return await enrich(track)
+
+    try:
+        while True:
+            fetcher = newData(True, shazam, enrich=enrichNew if enrich else None)
+            data = await fetcher.get()
+            if data and (not only_different or data != last_data):
+                last_data = data
+                last_key = fetcher.key
+                debug('Fetched song data successfully.')
+                await display(data, fetcher.extras)
+
+            await asyncio.sleep(delay)
+    finally:
+        # Also runs when the loop is cancelled by a keyboard interrupt
+        await shazam.http_client.close()
+
+async def monitor(sources: list, delay: int) -> None:
+    """
+    Listen to several input devices at once, they share one Shazam
+    client and a limit on the amount of requests in flight
+    """
+
+    shazam = song.shazamClient()
+    limiter = asyncio.Semaphore(args.max_requests)
+    # Every source records on a worker thread, so there need to be enough of them
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(len(sources) * 2 + 4))
+
+    async def watch(source: str) -> None:
+        device = int(source) if source.isdigit() else source
+        last_data = None # Data dict of the last song on this source
+        while True:
+            data = await newData(True, shazam, device, limiter, f'[{source}] ').get()
+            if data and data != last_data:
+                last_data = data
+                debug(f'[{source}] Fetched song data successfully.')
+                db_print(f'[{color(source, (255, 255, 255))}] {data["title"]} - {data["artists"]} ({data["album"]})')
+
+            await asyncio.sleep(delay)
+
+    try:
+        await asyncio.gather(*(watch(source) for source in sources))
+    finally:
+        await shazam.http_client.close()
+
+async def showHistory(data: list) -> None:
+    """
+    Display songs from the history
+    """
+
+    try:
+        for each in data:
+            await display(each)
+    finally:
+        await net.CLIENT.close()
 
 def main():
+    global args, cover_size
+    args = parser.parse_args()
+    cover_size = args.size
+
+    if args.debug:
+        # Turn on debugging and set the debug level
+        resources.DEBUG = True
+        resources.DEBUG_LEVEL = args.verbosity
+
+    else:
+        resources.DEBUG = False # Ensure that the debug mode is off (although it should be off already).
+        resources.DEBUG_LEVEL = 0
+
+    # Control the level of content to be shown (higher level = less content)
+    resources.MINIMALIST_LEVEL = args.minimalist
+
+    resources.CACHE_ONLY = args.cache_only
+    resources.COLOR_ENGINE = args.color_engine
+    resources.COLORS = resources.detectColors() if args.colors == 'auto' else args.colors
+    resources.HEDGE_DELAY = args.hedge
+    # Every source samples at its own pace, so they each get a budget
+    retry.POLICIES['shazam'].budget = args.shazam_budget or retry.SHAZAM_BUDGET * max(len(args.sources or []), 1)
+
+    debug(f'Initialized arguments.')
+    debug(args, level=1)
+
+    if args.freeze:
+        # Write all song history into a json file
+        debug(f'Freezing to file {args.freeze}.')
+
+        tracks = song.getHistory().get() # Get all the tracks as a list of dictionaries
+        debug(f'Loaded {tracks=}', level=2)
+
+        # Put the tracks into key value pairs
+        # with the key being the song title
+        data = {item['title']: {key: value for key, value in item.items() if key != 'title'} for item in tracks}
+        debug(f'Loaded {data=}', level=2)
+
+        # Save json
+        with open(args.freeze, 'w') as f:
+            debug('Writing to file...')
+            json.dump(data, f, indent=4)
+
+        debug(f'Written to {args.freeze} successfully.')
+
+        finish() # A function that exits the program but before doing it saves any log files
+
+    if args.log:
+        debug('Logging to file enabled.')
+        i = 0
+        debug('Finding debug log file path.')
+        # Find a valid name for the log
+        # file, with the format 'sngfetch_int.log'
+        while os.path.exists(os.path.join(os.getcwd(), f'sngfetch_{i}.log')):
+            i += 1
+
+        log = os.path.join(os.getcwd(), f'sngfetch_{i}.log')
+        debug(f'Found debug log file path: {log}.')
+        resources.LOG_PATH = log
+    else:
+        debug('Logging to file disabled.')
+
+    if args.disable_stdout:
+        debug('Disabled print.')
+        resources.DISABLE_STDOUT = True
+
+    if args.lyrics_setup:
+        debug('Lyrics setup.')
+        # Check if the API credentials are
+        # present and exit the program if they are
+        Lyrics.ensureAPIcreds(genius_api_path)
+        # The credentials aren't present since the program hasn't exited
+        if input('API credentials already exist, remove them [y/N]: ') == 'y':
+            os.remove(genius_api_path)
+            Lyrics.ensureAPIcreds(genius_api_path) # Create the file and ask the user to open it
+
+        db_print('Doing nothing.')
+        finish()
+
     # We have to check for an empty string as well
     # since the search string can also be empty
     if args.history or args.history == '':
@@ -292,16 +505,15 @@ def main():
         try:
             # Get the history with the search string stored in args.history
             # data is a list of dictionaries which are ready to be passed to display
-            data = song.History(args.history).get()
-            for each in data:
-                display(each)
+            data = song.getHistory().get(args.history)
+            asyncio.run(showHistory(data))
         except KeyboardInterrupt:
             debug('Keyboard interrupt.')
             db_print('\nExiting...')
 
         # Display the amount of songs in history and
         # the size of the file that stores the history
-        db_print(f'\n{len(data)} songs. ({resources.formatBytes(os.path.getsize(song.History().history_loc))})')
+        db_print(f'\n{len(data)} songs. ({resources.formatBytes(song.getHistory().size())})')
         debug('Displayed history successfully.')
         finish()
 
@@ -309,7 +521,7 @@ def main():
         # Remove a song from history by title which is stored in args.remove
         try:
             debug(f'Removing song with title {args.remove}.')
-            song.History().remove(args.remove)
+            song.getHistory().remove(args.remove)
         except KeyboardInterrupt:
             debug('Keyboard interrupt.')
             db_print('\nExiting...')
@@ -320,7 +532,7 @@ def main():
     if args.history_clear:
         try:
             debug('Clearing history of fetched songs.')
-            song.History().clear()
+            song.getHistory().clear()
         except KeyboardInterrupt:
             debug('Keyboard interrupt.')
             db_print('\nExiting...')
@@ -328,27 +540,50 @@ def main():
         debug('History cleared successfully.')
         finish()
 
+    if args.history_refresh:
+        try:
+            debug('Refreshing history of fetched songs.')
+            refreshed, incomplete = asyncio.run(song.getHistory().refresh(args.concurrency))
+            db_print(f'Refreshed {refreshed} of {incomplete} songs missing data.')
+        except KeyboardInterrupt:
+            debug('Keyboard interrupt.')
+            db_print('\nExiting...')
+
+        debug('History refresh ran successfully.')
+        finish()
+
+    if args.sources:
+        # Only print a line when a source plays a different song
+        debug(f'Monitoring sources {args.sources}.')
+        try:
+            asyncio.run(monitor(args.sources, args.continuous or args.continuous_until_different or 0))
+        except KeyboardInterrupt:
+            debug('Keyboard interrupt.')
+            db_print('\nExiting...')
+            finish()
+
+    if args.files:
+        try:
+            debug(f'Recognizing files {args.files}.')
+            asyncio.run(recognizeFiles())
+        except KeyboardInterrupt:
+            debug('Keyboard interrupt.')
+            db_print('\nExiting...')
+
+        debug('Batch ran successfully.')
+        finish()
+
     if args.continuous == 0 or args.continuous:
         # Search for songs until keyboard interrupt
         # wait for args.continuous seconds in between
 
         debug('Searching continuously.')
-        while True:
-            try:
-                debug(f'Started fetching song data with args {(args.total, args.duration, args.increase, True, args.linear) if not args.infinite else (-1, args.duration, args.increase, True, args.linear)}.')
-                # Get data trough microphone
-                # for an explanation of arguments look at the bottom (in the default behavior), except the last
-                # argument which signals to Data that the program is in continuous mode
-                data = asyncio.run(song.Data(args.total, args.duration, args.increase, True, args.linear).get() if not args.infinite else song.Data(-1, args.duration, args.increase, True, args.linear).get())
-                if data:
-                    debug('Fetched song data successfully.')
-                    display(data)
-            except KeyboardInterrupt:
-                debug('Keyboard interrupt.')
-                db_print('\nExiting...')
-                finish()
-            
-            sleep(args.continuous)
+        try:
+            asyncio.run(listen(args.continuous))
+        except KeyboardInterrupt:
+            debug('Keyboard interrupt.')
+            db_print('\nExiting...')
+            finish()
 
     elif args.continuous_until_different == 0 or args.continuous_until_different:
         # Search for songs util keyboard interrupt,
@@ -357,44 +592,23 @@ def main():
         # seconds in between
 
         debug('Searching continuously and only showing different songs.')
-        last_data = None # Data dict of the last song
-        while True:
-            try:
-                debug(f'Started fetching song data with args {(args.total, args.duration, args.increase, True, args.linear) if not args.infinite else (-1, args.duration, args.increase, True, args.linear)}.')
-                # Get data trough microphone
-                # for an explanation of arguments look at the bottom (in the default behavior), except the last
-                # argument which signals to Data that the program is in continuous mode
-                data = asyncio.run(song.Data(args.total, args.duration, args.increase, True, args.linear).get() if not args.infinite else song.Data(-1, args.duration, args.increase, True, args.linear).get())
-                if data and data != last_data:
-                    last_data = data
-                    debug('Fetched song data successfully.')
-                    display(data)
-            except KeyboardInterrupt:
-                debug('Keyboard interrupt.')
-                db_print('\nExiting...')
-                finish()
-            
-            sleep(args.continuous_until_different)
+        try:
+            asyncio.run(listen(args.continuous_until_different, only_different=True))
+        except KeyboardInterrupt:
+            debug('Keyboard interrupt.')
+            db_print('\nExiting...')
+            finish()
 
     # If there are no special arguments to override behavior
     try:
-        debug(f'Started fetching song data with args {(args.total, args.duration, args.increase, False, args.linear) if not args.infinite else (-1, args.duration, args.increase, False, args.linear)}.')
-        # Get the data from song.Data trough the microphone with arguments:
-        #   - args.total => the total amount of time the program will (at least try to (this is not the exact amount of time because of
-        #     args.duration and increases in time at the last few tries, these are avoidable with the --linear flag)) listen for in seconds
-        #
-        #   - args.duration => is the duration of each audio segment taken in seconds
-        #
-        #   - args.increase => the amount the duration increases each time in seconds (default=0)
-
-        data = asyncio.run(song.Data(args.total, args.duration, args.increase, False, args.linear).get() if not args.infinite else song.Data(-1, args.duration, args.increase, False, args.linear).get())
-        debug('Fetched song data successfully.')
-        display(data)
+        asyncio.run(fetch())
     except KeyboardInterrupt:
         debug('Keyboard interrupt.')
         db_print('\nExiting...')
         finish()
 
 if __name__ == '__main__':
+    # Batch's worker processes run this file again in frozen (PyInstaller) builds on Windows
+    multiprocessing.freeze_support()
     main()
     finish() # Ensure exit with saving logs
\ No newline at end of file
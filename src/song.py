@@ -1,93 +1,351 @@
-import requests
-from resources import sampleAudio, userError, getIndex, debug, db_print, finish, matching
-from shazamio import Shazam
+from resources import sampleAudio, userError, getIndex, debug, db_print, finish, matching, getCache
+from scheduler import SCHEDULERS
+from retry import POLICIES
+import resources
+import net
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import AsyncIterator, Awaitable, Callable
+import asyncio
+import threading
+import hashlib
+import json
+import math
+import time
+import sqlite3
+import atexit
+import ast
 import os
 import base64
 
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a', '.aac', '.opus') # Files picked up when a directory is passed to Batch
+HISTORY_LOCK = threading.Lock() # Serializes history writes
+HISTORY = None # The History opened by getHistory, shared by the whole program
+RECOGNITION_CACHE = {'ttl': 30 * 24 * 60 * 60, 'max_entries': 2000} # Options of the cache of recognized songs
+DEEZER_CACHE = {'ttl': 30 * 24 * 60 * 60, 'max_entries': 5000} # Options of the cache of Deezer responses
+DEEZER_ERROR_TTL = 24 * 60 * 60 # Responses without data are cached for a shorter time, Deezer may add the song later
+DEEZER_FIELDS = ('duration', 'bpm', 'gain', 'popularity') # Only known when the Deezer lookups worked
+
+class SessionClient:
+    """
+    Http client for Shazam that sends its requests trough the
+    shared session of net.CLIENT, so they reuse its connections
+    (Shazam only calls request, so it doesn't subclass shazamio's
+    HTTPClientInterface and shazamio isn't imported until it is used)
+    """
+
+    async def request(self, method: str, url: str, *args, **kwargs) -> list | dict:
+        from shazamio.utils import validate_json
+
+        # No retries here, failed requests are retried by POLICIES['shazam']
+        async with net.CLIENT.session().request(method.upper(), url, **kwargs) as resp:
+            resp.raise_for_status()
+            return await validate_json(resp, *args)
+
+    async def close(self) -> None:
+        await net.CLIENT.close()
+
+def shazamClient() -> 'Shazam':
+    """
+    A Shazam client using the shared session, close it with
+    await shazam.http_client.close() once it isn't needed anymore
+    """
+
+    from shazamio import Shazam
+
+    return Shazam(http_client=SessionClient())
+
+def generateSignature(audio: bytes | bytearray | str, duration: float = 10) -> 'Signature':
+    """
+    Fingerprint a .wav file (or a path to an audio file) locally,
+    this blocks so it is meant to be run on a worker thread
+    """
+
+    from shazamio_core import Recognizer, SearchParams
+
+    options = SearchParams(segment_duration_seconds=max(math.ceil(duration), 1))
+    recognizer = Recognizer(segment_duration_seconds=options.segment_duration_seconds)
+
+    async def fingerprint() -> 'Signature':
+        if isinstance(audio, str):
+            return await recognizer.recognize_path(audio, options)
+
+        return await recognizer.recognize_bytes(bytes(audio), options)
+
+    # The recognizer is asynchronous but does all of its work on Rust's side,
+    # so it gets a short lived loop on whichever thread this runs on
+    return asyncio.run(fingerprint())
+
+def fingerprintFile(path: str) -> tuple[str, SimpleNamespace | None, str]:
+    """
+    Fingerprint an audio file, this runs in a worker process so
+    the signature is returned as a plain (picklable) namespace with
+    the fields send_recognize_request_v2 uses, along with any error
+    """
+
+    try:
+        signature = generateSignature(path)
+    except Exception as e:
+        return path, None, str(e)
+
+    return path, SimpleNamespace(signature=SimpleNamespace(uri=signature.signature.uri, samples=signature.signature.samples), timestamp=signature.timestamp), ''
+
 class Data:
-    def __init__(self, timeout: int = 20, duration: int = 2, increase: int = 0, inf: bool = False, linear: bool = False):
-        self.isinfinite = timeout == -1 # If the search has no timeout limit
-        self.threshold = timeout // duration # The amount of iterations done
-        self.threshold += increase * self.threshold
-        self.duration = duration # The duration of each iteration
-        self.inc = increase # The increase of duration on each iteration
+    def __init__(self, timeout: int = 20, duration: int = 2, increase: int = 0, inf: bool = False, linear: bool = False, gate: bool = True, shazam: 'Shazam | None' = None, scheduler: str = 'fixed', device: int | str | None = None, limiter: asyncio.Semaphore | None = None, tag: str = '', enrich: Callable[[dict], Awaitable[dict]] | None = None):
         self.inf = inf # True if the continuous flag is passed
-        self.linear = linear # True if the linear flag is passed, causes the length to not increase at the last few iterations
-        debug(f'Initialized Data object with timeout {timeout}, duration {duration}, increase {increase}, infinite {inf}.', level=1)
+        self.device = device # The input device to listen to (None is the default device)
+        self.limiter = limiter # Shared between Data objects to cap the amount of requests in flight
+        self.tag = tag # Set when several sources are monitored at once, the progress line is hidden and debug messages are tagged
+        self.scheduler = SCHEDULERS[scheduler](timeout, duration, increase, inf, linear) # Decides the duration of each sample and when to stop
+        self.gate = gate # True if samples that can't contain music should be skipped instead of sent
+        self.skipped = 0 # The amount of samples skipped by the gate
+        self.shazam = shazam or shazamClient() # Pass one in to share its session between Data objects
+        self.enrich = enrich # Called with the Shazam track on a match, runs alongside the Deezer lookups (cover art, lyrics)
+        self.extras = {} # What enrich returned for the last match
+        self.key = None # Shazam's track key of the last match
+        self.stop = threading.Event() # Set to stop the capture thread once no more samples are needed
+        self.refresh = False # Set by History.refresh, cached Deezer responses without data are ignored and failures aren't printed
+        self.partial = False # Set by Batch, songs Deezer doesn't know keep the Shazam data instead of being given up on and failures aren't printed
+        debug(f'Initialized Data object with timeout {timeout}, duration {duration}, increase {increase}, infinite {inf}, scheduler {scheduler}.', level=1)
 
     async def get(self):
         """
         Return data about a song playing, via the microphone
         """
 
-        r = {'matches': []}
-        result = None
         itr = 0
+        pending = set() # Recognition requests still in flight, the next sample is recorded while they run
+        capture = None
+        self.stop = threading.Event() # A new one for every search
         
         # Loop until a match is found
-        debug(f'Listening for a song with a timeout of {self.threshold * self.duration} seconds.')
-        debug(f'Duration: {self.duration}, Threshold: {self.threshold}.', level=1)
+        debug(f'Listening for a song with a timeout of {self.scheduler.timeout} seconds.')
+        debug(f'Duration: {self.scheduler.duration}, Threshold: {self.scheduler.threshold}.', level=1)
         # Displaying the Listening line
-        if not self.inf:
-            db_print(f'\x1b[2K({itr}{('/' + str(self.threshold)) if not self.isinfinite else ''}) Listening...\x1b[1A\x1b[999999999D')
-        while not (r['matches']):
-            # Looping until there is a match or the threshold is exceeded
-            if not self.inf: 
-                db_print(f'\x1b[2K({itr}{('/' + str(self.threshold)) if not self.isinfinite else ''}) Listening...\x1b[1A\x1b[999999999D')
-            else:
-                db_print('Listening...\x1b[1A\x1b[999999999D')
-            
-            if not self.inf:
-                if (itr == self.threshold - 1) and (not self.isinfinite) and (not self.linear):
-                    debug(f'Last try, with a longer duration ({self.duration}).')
-                    # Last try; with a longer duration
-                    db_print(f'\x1b[2K({itr}/{self.threshold}) Last try...\x1b[1A\x1b[999999999D')
-                    self.duration += 3
-
-                elif (itr >= self.threshold - 4) and (not self.isinfinite) and (not self.linear):
-                    debug(f'Trying harder, with a longer duration ({self.duration}).')
-                    # Trying harder; with longer durations
-                    db_print(f'\x1b[2K({itr}/{self.threshold}) Trying harder...\x1b[1A\x1b[999999999D')
-                    self.duration += 1
-            
-            # Get the audio sample
-            debug(f'Getting audio for sample of duration {self.duration}.')
-            audio_bin = sampleAudio(self.duration)
-
-            # Get the song data
-            shazam = Shazam()
-            debug(f'Initialized Shazam.')
-            debug(f'Recognizing audio sample.')
-            try:
-                # Try to recognize the song, this will throw
-                # an exception if the API can't be accessed
-                result = await shazam.recognize(audio_bin)
-            except Exception as e:
-                debug(f'Shazam API error: {e}', 'error', '\x1b[31m')
-                if not self.inf: # If the program is in infinite (inf) mode an error on a single song shouldn't stop the program
-                    userError(f'Sorry the program has encountered an error with the Shazam API.')
-
-                return None # Only in inf mode
+        if not self.inf and not self.tag:
+            self._progress(itr)
+
+        try:
+            while (duration := self.scheduler.next(itr)) is not None:
+                # Looping until there is a match or the scheduler stops
+                if self.tag:
+                    pass # Progress lines of several sources would overwrite each other
+                elif not self.inf: 
+                    self._progress(itr)
+                else:
+                    db_print(f'\x1b[2KListening...{self._skippedText()}\x1b[1A\x1b[999999999D')
+                
+                # Get the audio sample and fingerprint it on a worker thread, so
+                # only the (small) signature is sent and the event loop stays free
+                debug(f'Getting signature for sample of duration {duration}.')
+                capture = asyncio.create_task(asyncio.to_thread(self.capture, duration))
+
+                # Handle the requests that finish while the sample is being recorded
+                while not capture.done():
+                    finished, _ = await asyncio.wait(pending | {capture}, return_when=asyncio.FIRST_COMPLETED)
+                    try:
+                        result = self._finished(finished & pending, pending)
+                    except Exception as e:
+                        return self._apiError(e)
+
+                    if result:
+                        debug(f'{self.tag}Got a match after {itr} iterations, while recording the next sample.')
+                        return await self._matched(result)
+
+                signature = capture.result()
+                self.scheduler.observe(level=resources.getAudioBuffer(self.device).level)
+                if signature is None:
+                    # The sample can't contain music, don't bother the API with it
+                    self.skipped += 1
+                    debug(f'{self.tag}Skipped sample without music ({self.skipped} skipped).')
+
+                else:
+                    # Get the song data in the background
+                    debug(f'Recognizing audio sample.')
+                    pending.add(asyncio.create_task(self.recognize(signature)))
+
+                itr += 1
+                debug(f'New iteration ({itr}).')
+
+            # No more samples will be taken, wait for the last requests
+            while pending:
+                finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                try:
+                    result = self._finished(finished, pending)
+                except Exception as e:
+                    return self._apiError(e)
+
+                if result:
+                    debug(f'{self.tag}Got a match after {itr} iterations.')
+                    return await self._matched(result)
+
+        finally:
+            # A match (or an error) makes the other attempts useless, cancelling
+            # the capture doesn't stop its thread so it is told to stop as well
+            self.stop.set()
+            for task in pending | ({capture} if capture else set()):
+                task.cancel()
+
+        # Threshold exceeded
+        debug(f'Exceeded threshold of {itr} attempts.')
+        # Same error handling reasons as in _apiError
+        if not self.inf: 
+            userError(f"Sorry couldn't recognize this song after {itr} attempts.\x1b[K")
+        return None
+
+    def _progress(self, itr: int) -> None:
+        """
+        Display the (itr/threshold) progress line
+        """
+
+        threshold = f'/{self.scheduler.threshold}' if self.scheduler.threshold is not None and not self.scheduler.isinfinite else ''
+        db_print(f'\x1b[2K({itr}{threshold}) {self.scheduler.status}{self._skippedText()}\x1b[1A\x1b[999999999D')
+
+    def _finished(self, tasks: set, pending: set) -> dict | None:
+        """
+        Collect finished recognition requests, returns the
+        matched result if any (raises the error of a failed request)
+        """
+
+        for task in tasks:
+            pending.discard(task)
+            result = task.result() # This will throw an exception if the API couldn't be accessed
             debug(f'Got result.')
 
-            r = result
-            itr += 1
-            debug(f'New iteration ({itr}).')
+            if result.get('matches'):
+                return result
+
+            self.scheduler.observe(matched=False)
+
+        return None
+
+    async def _matched(self, result: dict, nohistoryadd: bool = False) -> dict | None:
+        """
+        Parse a matched result, the parsed track is cached by Shazam's
+        track key (and the signature of files) so repeats of the same
+        song or file don't have to go trough the APIs again
+        """
+
+        cache = getCache('recognitions', **RECOGNITION_CACHE)
+        data = result.get('parsed') # Set when the signature was already in the cache
+        self.key = result.get('track', {}).get('key')
+
+        # Everything enrich needs is in the Shazam track, so it doesn't wait on Deezer
+        extras = asyncio.ensure_future(self.enrich(result['track'])) if self.enrich and 'track' in result else None
+        try:
+            if data is None:
+                track_key = f'track:{result["track"].get("key")}'
+                data = cache.get(track_key)
+                debug(f'Recognition cache {"hit" if data else "miss"} for {track_key} ({cache.stats()}).')
+
+                # Songs without Deezer data aren't cached, so the Deezer lookups (and their
+                # shorter DEEZER_ERROR_TTL) decide when the data is looked up again
+                complete = data is not None
+                if data is None:
+                    debug('Parsing result.')
+                    data = await self._parse(result['track'], nohistoryadd=True) # Added below, for cached songs as well
+                    complete = bool(data) and any(data.get(field, 'Unknown') != 'Unknown' for field in DEEZER_FIELDS)
+                    if complete:
+                        cache.set(track_key, data)
+
+                if complete and result.get('signature'):
+                    cache.set(f'signature:{result["signature"]}', data)
+
+            self.extras = await extras if extras and data else {}
+        finally:
+            if extras and not extras.done():
+                extras.cancel()
+
+        if data and not nohistoryadd and data['title'] != 'Unknown':
+            # The history may have been cleared since the song was cached
+            debug(f'Adding track data to history.')
+            with HISTORY_LOCK:
+                getHistory().add(data)
+
+        return data
+
+    def _apiError(self, e: Exception) -> None:
+        debug(f'Shazam API error: {e}', 'error', '\x1b[31m')
+        if not self.inf: # If the program is in infinite (inf) mode an error on a single song shouldn't stop the program
+            userError(f'Sorry the program has encountered an error with the Shazam API.')
 
-            if (itr >= self.threshold) and (not self.isinfinite):
-                # Threshold exceeded
-                debug(f'Exceeded threshold of {self.threshold} attempts.')
-                # Same error handling reasons as above (Shazam API error)
-                if not self.inf: 
-                    userError(f"Sorry couldn't recognize this song after {self.threshold} attempts.\x1b[K")
-                return None
+        return None # Only in inf mode
 
-        debug(f'Got a match after {itr} iterations.')
-        debug('Parsing result.')
+    def _skippedText(self) -> str:
+        return f' ({self.skipped} skipped)' if self.skipped else ''
 
-        return self._parse(r['track'])
+    def capture(self, duration: float) -> 'Signature | None':
+        """
+        Sample the microphone and fingerprint the sample, returns
+        None if the sample was skipped by the gate or self.stop is set
+        """
+
+        audio_bin = sampleAudio(duration, self.gate, self.device, self.stop)
+        if audio_bin is None or self.stop.is_set():
+            return None
+
+        signature = generateSignature(audio_bin, duration)
+        debug(f'Generated signature of {signature.signature.samples} ms.')
+
+        return signature
+
+    async def recognize(self, signature: 'Signature', cache_signature: bool = False) -> dict:
+        """
+        Send a signature to the Shazam API, on an error the same
+        signature is sent again as allowed by POLICIES['shazam'],
+        with cache_signature signatures that were recognized before
+        aren't sent at all (only files repeat exactly, a signature of
+        the microphone never does)
+        """
+
+        signature_hash = None
+        if cache_signature:
+            cache = getCache('recognitions', **RECOGNITION_CACHE)
+            signature_hash = hashlib.sha1(signature.signature.uri.encode('utf-8')).hexdigest()
+            data = cache.get(f'signature:{signature_hash}')
+            debug(f'Recognition cache {"hit" if data else "miss"} for signature {signature_hash} ({cache.stats()}).')
+            if data:
+                return {'matches': [signature_hash], 'parsed': data, 'signature': signature_hash}
+
+        # The limiter wakes its waiters in order, so sources get their turns fairly,
+        # it is only held while a request is in flight (not during the budget wait or backoff)
+        start = time.monotonic()
+        result = await POLICIES['shazam'].call(self.shazam.send_recognize_request_v2, signature, limiter=self.limiter)
+
+        self.scheduler.observe(latency=time.monotonic() - start)
+        result['signature'] = signature_hash # Only set when the signature is cached
+
+        return result
+
+    async def deezerGet(self, url: str) -> dict:
+        """
+        Get json from the Deezer API under POLICIES['deezer']
+        """
+
+        return await POLICIES['deezer'].call(net.CLIENT.get, url, timeout=10)
+
+    async def deezerLookup(self, key: str, url: str) -> dict:
+        """
+        Get json from the Deezer API trough the Deezer cache, in cache
+        only mode (resources.CACHE_ONLY) a miss returns an error response
+        """
+
+        cache = getCache('deezer', **DEEZER_CACHE)
+        response = cache.get(key)
+        debug(f'Deezer cache {"hit" if response is not None else "miss"} for {key} ({cache.stats()}).')
+        if response is not None and not (self.refresh and (response.get('error') or response.get('total') == 0)):
+            return response
+
+        if resources.CACHE_ONLY:
+            return {'error': f'{key} is not cached (cache only mode).', 'uncached': True}
 
-    def isrcLookup(self, isrc: str):
+        response = await self.deezerGet(url)
+        empty = response.get('error') or response.get('total') == 0
+        cache.set(key, response, ttl=DEEZER_ERROR_TTL if empty else None)
+
+        return response
+
+    async def isrcLookup(self, isrc: str):
         """
         Lookup song by its isrc (a unique id for a song)
         This doesn't work on every song, since deezer
@@ -99,15 +357,93 @@ class Data:
         # Get the song data from Deezer
         try:
             debug(f'Getting data from the Deezer API.')
-            response = requests.get(deezer_api).json()
+            response = await self.deezerLookup(f'isrc:{isrc}', deezer_api)
             debug('Got response')
-        except requests.exceptions.RequestException as e:
-            userError(f"An Error occurred: {e}\x1b[K")
-            response = {'error': e}
+        except Exception as e:
+            if not self.inf:
+                userError(f"An Error occurred: {e}\x1b[K")
+            debug(f'Deezer API error: {e}', 'error', '\x1b[31m')
+            response = {'error': str(e)}
+
+        return response
+
+    async def searchLookup(self, title: str, subtitle: str) -> dict:
+        """
+        Search Deezer for the song by its title and main artist
+        """
+
+        # deezer_api holds the search url for the api
+        deezer_api = f'https://api.deezer.com/search?q=artist:"{subtitle.split(',')[0]}",track:"{title}"'
+        debug(f'API url: {deezer_api}', level=1)
+        try:
+            # The query is normalized for the cache key so the same song always has the same key
+            query = ' '.join(f'{subtitle.split(',')[0]}|{title}'.lower().split())
+            response = await self.deezerLookup(f'search:{query}', deezer_api)
+            debug(f'Got response from Deezer search.')
+        except Exception as e:
+            debug(f'Deezer API error: {e}', 'error', '\x1b[31m')
+            response = {'total': 0, 'failed': True} # Failed, not just without results
 
         return response
 
-    def _parse(self, track_data: dict, nohistoryadd: bool = False):
+    def _searchMatch(self, response: dict, subtitle: str) -> dict | None:
+        """
+        The track in a Deezer search response by the artists Shazam gave, if any
+        """
+
+        debug(f'Parsing Deezer response.')
+        for i in response.get('data') or []:
+            debug(f'Checking if it is the correct track.', level=1)
+            debug(f'response track artist(s): {subtitle.strip().lower()}, real track artist(s): {i['artist']['name'].lower()}', level=2)
+            # Check if the result contains the correct track by matching the artist from the shazam api and the one returned here
+            if matching(subtitle.strip().lower(), i['artist']['name'].lower()):
+                debug(f'Found a correct track.')
+                return i
+
+        return None
+
+    async def _hedged(self, result: dict, subtitle: str) -> tuple[dict, asyncio.Future | None]:
+        """
+        Lookup the ISRC, and if it hasn't answered after resources.HEDGE_DELAY
+        seconds search for the song as well, the first usable answer wins and
+        the other request is cancelled; returns the ISRC response (an error
+        when the search won) and the search if one was started
+        """
+
+        lookup = asyncio.ensure_future(self.isrcLookup(result['isrc']))
+        search = None
+        try:
+            done, _ = await asyncio.wait({lookup}, timeout=resources.HEDGE_DELAY)
+            if done:
+                return lookup.result(), None
+
+            debug(f'No answer to the ISRC lookup after {resources.HEDGE_DELAY} seconds, searching as well.', 'warning', '\x1b[33m')
+            search = asyncio.ensure_future(self.searchLookup(result['title'], subtitle))
+            done, _ = await asyncio.wait({lookup, search}, return_when=asyncio.FIRST_COMPLETED)
+
+            if lookup in done:
+                if not lookup.result().get('error', ''):
+                    search.cancel()
+                    debug('The ISRC lookup answered first.')
+                    return lookup.result(), None
+
+                return lookup.result(), search
+
+            if self._searchMatch(search.result(), subtitle):
+                lookup.cancel()
+                debug('The search answered first.')
+                return {'error': 'The search answered first.'}, search
+
+            # The search has nothing, so it is up to the ISRC lookup
+            return await lookup, search
+
+        except asyncio.CancelledError:
+            for task in (lookup, search):
+                if task:
+                    task.cancel()
+            raise
+
+    async def _parse(self, track_data: dict, nohistoryadd: bool = False):
         """
         Parse data from the Shazam API (it gives a lot of cluttered json)
         """
@@ -133,43 +469,65 @@ class Data:
         }
 
         debug(f'{result=}', level=2)
+
+        result = await self._deezer(result, track_data.get('subtitle', ''))
+        if result is None:
+            return None
         
+        if not nohistoryadd and result['title'] != 'Unknown':
+            debug(f'Adding track data to history.')
+            with HISTORY_LOCK:
+                getHistory().add(result)
+
+        return result
+
+    async def _deezer(self, result: dict, subtitle: str) -> dict | None:
+        """
+        Add the data from Deezer to a parsed result (subtitle holds the artists
+        as Shazam gives them), returns None if the song should be given up on
+        """
+
         # Try to get the rest of the data trough deezer via their isrc lookup
-        response = self.isrcLookup(result['isrc'])
+        search = None # Set when the search was started alongside the ISRC lookup
+        if resources.HEDGE_DELAY is None:
+            response = await self.isrcLookup(result['isrc'])
+        else:
+            response, search = await self._hedged(result, subtitle)
         debug(f'Got response from ISRC lookup.')
 
         # If the isrc lookup fails try searching for the song by title and artist instead
         if response.get('error', ''):
-            # deezer_api holds the search url for the api
-            deezer_api = f'https://api.deezer.com/search?q=artist:"{track_data.get('subtitle').split(',')[0]}",track:"{track_data.get("title")}"'
             debug(f'No data found for ISRC. Searching Deezer for the song.', 'warning', '\x1b[33m')
-            debug(f'API url: {deezer_api}', level=1)
-            response = requests.get(deezer_api).json()
-            debug(f'Got response from Deezer search.')
-            # 0 responses means no data was found on song (the api likely returned an error)
-            if response['total'] == 0:
-                if not self.inf:
-                    userError(f"Sorry unable to get data on the song '{result['title']}'.\x1b[K")
-                else:
-                    print(f"Sorry unable to get data on the song '{result['title']}'.\x1b[A")
-                    return None
+            response = await search if search else await self.searchLookup(result['title'], subtitle)
 
-            debug(f'Parsing Deezer response.')
-            found_track = False
-            for i in response.get('data'):
-                debug(f'Checking if it is the correct track.', level=1)
-                debug(f'response track artist(s): {track_data.get('subtitle').strip().lower()}, real track artist(s): {i['artist']['name'].lower()}', level=2)
-                # Check if the result contains the correct track by matching the artist from the shazam api and the one returned here
-                if matching(track_data.get('subtitle').strip().lower(), i['artist']['name'].lower()):
-                    debug(f'Found a correct track.')
-                    response = i
-                    found_track = True
-                    break
-
-            if not found_track:
-                debug('Could not get any data on track.', 'error', '\x1b[31m')
-                print('Could not get any data on track.')
-                finish()
+            if response.get('uncached'):
+                # Cache only mode, so only the Shazam data can be shown
+                debug(response['error'], 'warning', '\x1b[33m')
+
+            elif self.partial and not response.get('failed') and not self._searchMatch(response, subtitle):
+                # Shazam matched it, so only the Shazam data is shown instead of giving up
+                debug(f"Deezer doesn't know '{result['title']}', keeping the Shazam data.", 'warning', '\x1b[33m')
+                response = {}
+
+            else:
+                # 0 responses means no data was found on song (the api likely returned an error)
+                if response.get('total', 0) == 0:
+                    if not self.inf:
+                        userError(f"Sorry unable to get data on the song '{result['title']}'.\x1b[K")
+                    else:
+                        if not self.refresh and not self.partial:
+                            print(f"Sorry unable to get data on the song '{result['title']}'.\x1b[A")
+                        return None
+
+                response = self._searchMatch(response, subtitle)
+                if response is None:
+                    debug('Could not get any data on track.', 'error', '\x1b[31m')
+                    if not self.refresh and not self.partial:
+                        print('Could not get any data on track.')
+                    if not self.inf:
+                        finish()
+
+                    return None
         
         # The isrc lookup worked or we got the necessary data from the search
         if not response.get('error', '') and response:
@@ -196,7 +554,7 @@ class Data:
             # Update the result with all the new data
             result.update({
                 'artists': artists,
-                'cover': deezer_data.get('album', {}).get('cover'),
+                'cover': result['cover'] or deezer_data.get('album', {}).get('cover'), # Shazam's cover art is larger
                 'album': deezer_data.get('album', {}).get('title', 'Unknown'),
                 'duration': f'{minutes}:{str(seconds).rjust(2, '0')}' if minutes and seconds else 'Unknown',
                 'link': deezer_data.get('link', result['link']),
@@ -213,81 +571,291 @@ class Data:
             # Search by artist, title and isrc all failed,
             # can only display the data the Shazam API returns
             debug(f'Could only get limited data on song.', 'warning', '\x1b[33m')
-        
-        if not nohistoryadd and result['title'] != 'Unknown':
-            debug(f'Adding track data to history.')
-            History().add(result)
 
         return result
     
+class Batch:
+    def __init__(self, paths: list, workers: int | None = None, concurrency: int = 4, checkpoint: str = ''):
+        self.paths = self.expand(paths)
+        self.workers = workers # Fingerprinting processes, None uses one per cpu
+        self.concurrency = concurrency # The maximum amount of files being recognized at the same time
+        # Files already done, so an interrupted batch can resume; named after the files
+        # in the batch so a different batch in the same directory doesn't resume from it
+        digest = hashlib.sha1('\n'.join(sorted(self.paths)).encode('utf-8')).hexdigest()[:16]
+        self.checkpoint = checkpoint or os.path.join(os.getcwd(), f'.sngfetch_batch_{digest}')
+        self.data = Data(inf=True) # Only used for recognize and _parse, inf so one bad file doesn't stop the batch
+        self.data.partial = True # A file Shazam matched counts as recognized even without Deezer data
+        debug(f'Initialized Batch object with {len(self.paths)} files, {workers} workers and concurrency {concurrency}.', level=1)
+
+    def expand(self, paths: list) -> list:
+        """
+        Replace directories with the audio files inside of them
+        """
+
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files += sorted(os.path.join(root, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                debug(f'{path} does not exist, skipping.', 'warning', '\x1b[33m')
+
+        return files
+
+    def done(self) -> set:
+        """
+        Read the paths finished in a previous (interrupted) run from the checkpoint
+        """
+
+        if not os.path.exists(self.checkpoint):
+            return set()
+
+        with open(self.checkpoint, 'r') as f:
+            done = {json.loads(line)['path'] for line in f if line.strip()}
+
+        debug(f'Resuming batch, {len(done)} files were already done.')
+        return done
+
+    async def run(self) -> AsyncIterator[tuple[str, dict | None]]:
+        """
+        Recognize all the files, yielding (path, data) as each one
+        finishes, data is None if the file couldn't be recognized
+        """
+
+        done = self.done()
+        todo = [path for path in self.paths if path not in done]
+        debug(f'{len(todo)} files left to recognize.')
+
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        with ProcessPoolExecutor(self.workers) as pool, open(self.checkpoint, 'a') as checkpoint:
+            async def recognize(path: str) -> tuple[str, dict | None, bool]:
+                """
+                Returns (path, data, final), final is False when the file should be
+                tried again on resume (API errors, no match or no Deezer data)
+                """
+
+                # Fingerprinting runs in the pool, only the requests are limited by the semaphore
+                path, signature, error = await loop.run_in_executor(pool, fingerprintFile, path)
+                if signature is None:
+                    # The file itself is the problem, trying again won't help
+                    debug(f'Could not fingerprint {path}: {error}', 'error', '\x1b[31m')
+                    return path, None, True
+
+                async with semaphore:
+                    try:
+                        result = await self.data.recognize(signature, cache_signature=True)
+                    except Exception as e:
+                        debug(f'Shazam API error on {path}: {e}', 'error', '\x1b[31m')
+                        return path, None, False
+
+                    if not result.get('matches'):
+                        debug(f'No match for {path}.')
+                        return path, None, False
+
+                    data = await self.data._matched(result)
+                    return path, data, data is not None
+
+            tasks = [asyncio.create_task(recognize(path)) for path in todo]
+            retry = 0 # Files left for the next run
+            try:
+                for task in asyncio.as_completed(tasks):
+                    path, data, final = await task
+                    retry += not final
+                    if final:
+                        checkpoint.write(json.dumps({'path': path, 'title': data['title'] if data else None}) + '\n')
+                        checkpoint.flush()
+                    yield path, data
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+                await self.data.shazam.http_client.close()
+
+        if retry:
+            # Running the same batch again only retries these
+            debug(f'Batch finished, {retry} files can be retried, kept checkpoint {self.checkpoint}.')
+            return
+
+        # The whole batch finished, so there is nothing to resume
+        os.remove(self.checkpoint)
+        debug('Batch finished, removed checkpoint.')
+
 class History:
+    """
+    The fetched songs, kept in an sqlite database (in WAL mode so a
+    reader never waits on a writer) with a row per track: its data as
+    json, a digest of it (unique, so checking if a track is already
+    saved is one index lookup) and its ISRC, title and artists
+    """
+
     def __init__(self, search_by: str=''):
-        self.split_char = '|' # The character that splits the base64 encoded dicts of data in the history file
         self.search_str = search_by
-        self.tracks = []
-        self.history_loc = f'{os.path.expanduser("~")}/.sngfetch_history' # The location of the history file (/home/.sngfetch_history on linux)
+        self.history_loc = f'{os.path.expanduser("~")}/.sngfetch_history.db' # The location of the history database (/home/.sngfetch_history.db on linux)
+        self.legacy_loc = f'{os.path.expanduser("~")}/.sngfetch_history' # The history file of older versions, migrated once
         debug(f'Initialized History object with location {self.history_loc}.')
 
-        if os.path.exists(self.history_loc):
-            debug(f'History file exists.')
+        self.db = sqlite3.connect(self.history_loc, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY, digest TEXT NOT NULL UNIQUE, isrc TEXT, title TEXT, artists TEXT, data TEXT NOT NULL)')
+            # Searches match titles and artists loosely (resources.matching), which no index can
+            # answer, so the columns are only there to search without decoding every track
+            for index in ('tracks_isrc', 'tracks_title', 'tracks_artists'):
+                self.db.execute(f'DROP INDEX IF EXISTS {index}')
 
-            with open(self.history_loc, 'r') as f:
-                content = f.read()
+        if os.path.exists(self.legacy_loc):
+            self.migrate()
 
-                if not content:
-                    debug('No tracks.')
+    def migrate(self):
+        """
+        Move the tracks of the legacy history file (base64 encoded
+        dicts split by |) into the database, the file is renamed
+        afterwards so it only happens once
+        """
 
-                else:
-                    for element in content.split('|'):
-                        element = element.strip()
-                        debug(f'{element=}', level=1)
-                        
-                        if element:
-                            # Decode tracks and add them to the self.tracks variable
-                            self.tracks.append(eval(base64.b64decode(element).decode('utf-8')))
-                            debug(f'Track number {len(self.tracks)} was added to self.tracks.')
+        debug(f'Migrating legacy history file {self.legacy_loc}.')
+        with open(self.legacy_loc, 'r') as f:
+            content = f.read()
 
-        else:
-            debug(f'History file does not exist. Creating one.')
-            with open(self.history_loc, 'w') as f:
-                f.write('')
+        tracks = []
+        for element in content.split('|'):
+            element = element.strip()
+            debug(f'{element=}', level=1)
+
+            if element:
+                # The dicts were written with str(), literal_eval reads them without running anything
+                try:
+                    tracks.append(ast.literal_eval(base64.b64decode(element).decode('utf-8')))
+                except (ValueError, SyntaxError, UnicodeDecodeError) as e:
+                    debug(f'Skipping unreadable history entry: {e}', 'warning', '\x1b[33m')
+
+        with self.db:
+            self.db.executemany('INSERT OR IGNORE INTO tracks (digest, isrc, title, artists, data) VALUES (?, ?, ?, ?, ?)', map(self._columns, tracks))
+
+        os.replace(self.legacy_loc, f'{self.legacy_loc}.migrated')
+        debug(f'Migrated {len(tracks)} tracks, the legacy file was renamed to {self.legacy_loc}.migrated.')
+
+    def _columns(self, track_data: dict) -> tuple:
+        """
+        The values of a track's row (without its id)
+        """
+
+        digest = hashlib.sha1(json.dumps(track_data, sort_keys=True).encode('utf-8')).hexdigest() # Sorted so equal tracks have the same digest
+        artists = track_data.get('artists', '')
+        # Tracks without Deezer data keep the artists as a list
+        artists = ' '.join(artists) if isinstance(artists, list) else str(artists)
+
+        return digest, track_data.get('isrc'), track_data.get('title'), artists, json.dumps(track_data)
+
+    def _rows(self, where: str = '', params: tuple = ()) -> list[tuple[int, dict]]:
+        """
+        The (id, track data) of the matching rows, oldest first
+        """
+
+        return [(id, json.loads(data)) for id, data in self.db.execute(f'SELECT id, data FROM tracks {where} ORDER BY id', params)]
+
+    @property
+    def tracks(self) -> list:
+        """
+        Every track in the history, reads all of them
+        """
+
+        return [track for _, track in self._rows()]
+
+    def size(self) -> int:
+        """
+        The size of the history on disk in bytes, recent writes
+        are in the -wal file until they are checkpointed
+        """
 
-            debug(f'Successfully created history file.')
+        return sum(os.path.getsize(path) for path in (self.history_loc, f'{self.history_loc}-wal', f'{self.history_loc}-shm') if os.path.exists(path))
+
+    def close(self):
+        self.db.close()
+        debug('Closed history database.')
 
     def add(self, track_data: dict):
         debug(f'Adding track data to history.')
 
-        if not self.exists(track_data):
-            debug(f'Track data does not exist in history. Adding.')
-            self.tracks.append(track_data) # Ensure self.tracks is synced with the history file
-            debug(f'Added track data.')
-        
-            with open(self.history_loc, 'a') as f:
-                # base64 encode the dict and add it to history
-                f.write(f'{base64.b64encode(bytes(str(track_data), 'utf-8')).decode('utf-8')}{self.split_char}')
-            
-            debug(f'Added track data to history file.')
-        
+        with self.db:
+            added = self.db.execute('INSERT OR IGNORE INTO tracks (digest, isrc, title, artists, data) VALUES (?, ?, ?, ?, ?)', self._columns(track_data)).rowcount
+
+        if added:
+            debug(f'Added track data to history.')
         else:
             debug(f'Track data already exists in history. Not adding.')
 
+    def incomplete(self) -> list[tuple[int, dict]]:
+        """
+        The (id, track data) of the tracks saved while the Deezer lookups failed
+        """
+
+        # Filtered by sqlite, so only the incomplete tracks are decoded
+        where = ' AND '.join(f"coalesce(json_extract(data, '$.{field}'), 'Unknown') = 'Unknown'" for field in DEEZER_FIELDS)
+        return self._rows(f'WHERE {where}')
+
+    async def refresh(self, concurrency: int = 4) -> tuple[int, int]:
+        """
+        Run the Deezer lookups again for the incomplete tracks, at most concurrency
+        at a time (and within POLICIES['deezer']), the history is only written
+        once when all of them are done, returns (refreshed, incomplete)
+        """
+
+        tracks = self.incomplete()
+        debug(f'Refreshing {len(tracks)} incomplete tracks with concurrency {concurrency}.')
+
+        data = Data(inf=True) # inf so one track without data doesn't stop the refresh
+        data.refresh = True
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def refresh(track: dict) -> dict | None:
+            async with semaphore:
+                # Tracks without Deezer data keep the artists as Shazam's subtitle split on spaces
+                subtitle = ' '.join(track['artists']) if isinstance(track['artists'], list) else track['artists']
+                try:
+                    return await data._deezer(dict(track), subtitle)
+                except Exception as e:
+                    debug(f'Could not refresh {track["title"]}: {e}', 'error', '\x1b[31m')
+                    return None
+
+        try:
+            results = await asyncio.gather(*(refresh(track) for _, track in tracks))
+        finally:
+            await data.shazam.http_client.close()
+
+        refreshed = []
+        for (id, track), result in zip(tracks, results):
+            if result and any(result[field] != 'Unknown' for field in DEEZER_FIELDS):
+                debug(f'Refreshed {track["title"]}.')
+                refreshed.append((*self._columns(result), id))
+
+        # Written in one transaction once all of them are done, a refreshed
+        # track equal to one already saved replaces it instead of failing
+        with self.db:
+            self.db.executemany('UPDATE OR REPLACE tracks SET digest = ?, isrc = ?, title = ?, artists = ?, data = ? WHERE id = ?', refreshed)
+
+        return len(refreshed), len(tracks)
+
     def exists(self, track_data: dict):
-        if track_data in self.tracks:
-            return True
-        
-        return False
+        return self.db.execute('SELECT 1 FROM tracks WHERE digest = ?', self._columns(track_data)[:1]).fetchone() is not None
     
-    def get(self):
-        if not self.search_str:
+    def get(self, search_by: str | None = None):
+        search_str = self.search_str if search_by is None else search_by
+        if not search_str:
             debug(f'Returning whole history of fetched songs.')
             return self.tracks
 
         else:
             response = []
-            for track in self.tracks:
+            # Only the tracks that match are decoded
+            for title, artists, data in self.db.execute('SELECT title, artists, data FROM tracks ORDER BY id'):
                 # Check if the search string matches the title or artist of the track
-                if matching(self.search_str.lower(), track['title'].lower()) or matching(self.search_str.lower(), track['artists'].lower()):
-                    response.append(track)
+                if matching(search_str.lower(), (title or '').lower()) or matching(search_str.lower(), artists.lower()):
+                    response.append(json.loads(data))
             
             return response
     
@@ -301,9 +869,8 @@ class History:
                 
         if confirm == 'y':
             debug(f'Clearing history.')
-            self.tracks = []
-            with open(self.history_loc, 'w') as f:
-                f.write('')
+            with self.db:
+                self.db.execute('DELETE FROM tracks')
 
             debug(f'History cleared.')
             db_print('History cleared.')
@@ -317,12 +884,14 @@ class History:
         found_any = False
         debug(f'Checking if song exists in history and if found asking for deletion conformation.')
 
-        for i in self.tracks:
-            debug(f'{i["title"]=}', level=1)
-            debug(f'{i=}', level=2)
+        for id, track_title, data in self.db.execute('SELECT id, title, data FROM tracks ORDER BY id').fetchall():
+            debug(f'{track_title=}', level=1)
 
-            # Check if the provided title matches the one of the current track
-            if matching(title.lower(), i['title'].lower()):
+            # Check if the provided title matches the one of the current track,
+            # only the tracks that match are decoded
+            if matching(title.lower(), (track_title or '').lower()):
+                i = json.loads(data)
+                debug(f'{i=}', level=2)
                 debug(f'Found song in history, asking for conformation.')
                 confirm = input(f"Remove '{i['title']} by {i['artists']}'? [y/n]: ").lower()
 
@@ -332,14 +901,10 @@ class History:
                 
                 if confirm == 'y':
                     debug(f'Removing song from history.')
-                    self.tracks.remove(i)
-                    debug('Removed song from self.tracks.')
-                    with open(self.history_loc, 'w') as f:
-                        debug(f'Writing {self.tracks}', level=2)
-                        # Remove from file
-                        f.write(self.split_char.join(list(map(lambda i: base64.b64encode(str(i).encode('utf-8')).decode('utf-8'), self.tracks))))
+                    with self.db:
+                        self.db.execute('DELETE FROM tracks WHERE id = ?', (id,))
                     
-                    debug(f'Removed song from history file.')
+                    debug(f'Removed song from history database.')
 
                     db_print(f"Removed '{i['title']}' from history.")
                     found_any = True
@@ -351,4 +916,17 @@ class History:
                 found_any = True
             
         if not found_any:
-            userError(f"Could not find any song matching the title '{title}'.")
\ No newline at end of file
+            userError(f"Could not find any song matching the title '{title}'.")
+
+def getHistory() -> History:
+    """
+    Open the history once and reuse it for the rest of the program,
+    it is closed when the program exits
+    """
+
+    global HISTORY
+    if HISTORY is None:
+        HISTORY = History()
+        atexit.register(HISTORY.close)
+
+    return HISTORY
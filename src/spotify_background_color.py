@@ -1,7 +1,4 @@
 import numpy as np
-import scipy.misc as sp # Don't remove
-import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
 from PIL import Image
 
 """
@@ -46,7 +43,7 @@ class SpotifyBackgroundColor():
             img = Image.fromarray(self.img)
             self.img = np.asarray(img.resize(image_processing_size, Image.BILINEAR))
 
-    def best_color(self, k=8, color_tol=10, plot=False):
+    def best_color(self, k=8, color_tol=10, plot=False, fast=False, sample_size=16384):
         """Returns a suitable background color for the given image.
 
         Uses k-means clustering to find `k` distinct colors in
@@ -65,20 +62,34 @@ class SpotifyBackgroundColor():
                 record/33994/files/HaslerS03.pdf.
             plot (bool): Plot the original image, k-means result and
                 calculated background color. Only used for testing.
+            fast (bool): Cluster a random sample of the pixels instead
+                of all of them and score all the colors at once. Unlike
+                a thumbnail a sample keeps small areas of color intact.
+            sample_size (int): Amount of pixels sampled when `fast`.
 
         Returns:
             tuple: (R, G, B). The calculated background color.
 
         """
+        # Imported here so importing this module stays cheap
+        from sklearn.cluster import KMeans
+
         artwork = self.img.copy()
         self.img = self.img.reshape((self.img.shape[0]*self.img.shape[1], 3))
 
+        if fast and len(self.img) > sample_size:
+            rng = np.random.default_rng(0)
+            self.img = self.img[rng.choice(len(self.img), sample_size, replace=False)]
+
         clt = KMeans(n_clusters=k)
         clt.fit(self.img)
         hist = self.find_histogram(clt)
         centroids = clt.cluster_centers_
 
-        colorfulness = [self.colorfulness(color[0], color[1], color[2]) for color in centroids]
+        if fast:
+            colorfulness = self.colorfulness_all(centroids)
+        else:
+            colorfulness = [self.colorfulness(color[0], color[1], color[2]) for color in centroids]
         max_colorful = np.max(colorfulness)
 
         if max_colorful < color_tol:
@@ -89,6 +100,8 @@ class SpotifyBackgroundColor():
             best_color = centroids[np.argmax(colorfulness)]
 
         if plot:
+            import matplotlib.pyplot as plt
+
             bar = np.zeros((50, 300, 3), dtype='uint8')
             square = np.zeros((50, 50, 3), dtype='uint8')
             start_x = 0
@@ -168,3 +181,22 @@ class SpotifyBackgroundColor():
         mean_root = np.sqrt((rg_mean ** 2) + (yb_mean ** 2))
 
         return std_root + (0.3 * mean_root)
+
+    def colorfulness_all(self, colors):
+        """Returns the colorfulness index of every color at once.
+
+        The same as calling `colorfulness` on each color, the
+        standard deviations of a single color are always 0.
+
+        Args:
+            colors (ndarray): RGB colors, one per row.
+
+        Returns:
+            ndarray: Colorfulness metric of each color.
+
+        """
+        r, g, b = colors[:, 0], colors[:, 1], colors[:, 2]
+        rg = np.absolute(r - g)
+        yb = np.absolute(0.5 * (r + g) - b)
+
+        return 0.3 * np.sqrt((rg ** 2) + (yb ** 2))